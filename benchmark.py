@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks of the XPlane envs against a local MockDubinsPilot, so no X-Plane is needed.
+
+Reports the frames/second decoded (offline and through a connection), the step latency percentiles in lockstep
+mode, the reset duration and the overhead of the wrappers. Run it before and after a change of the transport,
+the decoders or the wrappers:
+
+    python benchmark.py --transport process --json results.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+
+from gym_XPlaneEEE.envs import XplaneEEEGlideAngleEnv, XplaneEEESpeedEnv
+from gym_XPlaneEEE.utils.dataCenter import GLIDE_ANGLE_STATE_KEYS, LOCKSTEP_KEYS, DataCenter
+from gym_XPlaneEEE.utils.frameDecoder import FrameDecoder
+from gym_XPlaneEEE.utils.IpcClient import IpcClient
+from gym_XPlaneEEE.utils.asyncIpcClient import AsyncIpcClient
+from gym_XPlaneEEE.utils.processIpcClient import ProcessIpcClient
+from gym_XPlaneEEE.utils.planeStateDecoder import PlaneStateDecoder
+from gym_XPlaneEEE.utils.latencyStats import LatencyStats, WRAPPER_PREFIX
+from gym_XPlaneEEE.utils.mockDubinsPilot import MockDubinsPilot
+from gym_XPlaneEEE.wrappers import wrappers
+
+ENVS = {'glideAngle': XplaneEEEGlideAngleEnv, 'speed': XplaneEEESpeedEnv}
+PERCENTILES = [50, 90, 99, 99.9]
+
+def percentiles(durations):
+    """The PERCENTILES, mean and max [ms] of the durations [s]."""
+    durations = 1000 * np.asarray(durations)
+    result = {'p{:g}'.format(q): float(np.percentile(durations, q)) for q in PERCENTILES}
+    result['mean'] = float(durations.mean())
+    result['max'] = float(durations.max())
+    return result
+
+def newClient(transport):
+    if transport == 'asyncio':
+        return AsyncIpcClient(DataCenter())
+    if transport == 'process':
+        return ProcessIpcClient()
+    return IpcClient(DataCenter())
+
+def benchmarkDecoding(frames, extraDataRefs):
+    """Frames/second of the plain FrameDecoder (json.loads) and of the PlaneStateDecoder, without any socket."""
+    mock = MockDubinsPilot(None, publishRate=0, extraDataRefs=extraDataRefs)
+    data = b''.join(mock.encodeState() for _ in range(frames))
+    result = {'frameBytes': len(data) // frames}
+    decoders = [('json', FrameDecoder()),
+                ('planeState', FrameDecoder(PlaneStateDecoder(GLIDE_ANGLE_STATE_KEYS + LOCKSTEP_KEYS)))]
+    for name, decoder in decoders:
+        start = time.perf_counter()
+        #feed in chunks as they come from the socket
+        for idx in range(0, len(data), 65536):
+            decoder.feed(data[idx:idx + 65536])
+        result[name + 'FramesPerSecond'] = decoder.decodedFrames / (time.perf_counter() - start)
+    return result
+
+def benchmarkThroughput(socketName, transport, frames, extraDataRefs):
+    """Frames/second received and decoded by a client when the mock sends them as fast as it can."""
+    with MockDubinsPilot(socketName, publishRate=0, extraDataRefs=extraDataRefs) as mock:
+        client = newClient(transport)
+        client.connect(socketName)
+        client.setStateDecoder(PlaneStateDecoder(GLIDE_ANGLE_STATE_KEYS + LOCKSTEP_KEYS))
+        client.daemon = True
+        client.start()
+        dc = client.dc
+        #warm up until the client receives frames
+        while not mock.connections:
+            time.sleep(0.01)
+        seq = dc.frameSeq
+        mock.burst(1)
+        dc.waitForNFrames(1, since=seq, timeout=10.0)
+        seq = dc.frameSeq
+        start = time.perf_counter()
+        mock.burst(frames)
+        dc.waitForNFrames(frames, since=seq, timeout=60.0)
+        duration = time.perf_counter() - start
+        received = dc.frameSeq - seq
+        client.setContinueFlag(False)
+    return {'frames': received, 'framesPerSecond': received / duration}
+
+def benchmarkSteps(socketName, transport, envName, steps):
+    """Step latencies in lockstep mode, in total and per stage."""
+    latencyStats = LatencyStats()
+    with MockDubinsPilot(socketName, publishRate=0):
+        env = ENVS[envName](socketName=socketName, transport=transport, lockstep=True, latencyStats=latencyStats)
+        env.reset()
+        durations = np.empty(steps)
+        for idx in range(steps):
+            start = time.perf_counter()
+            env.step(0.1)
+            durations[idx] = time.perf_counter() - start
+        env.close()
+    result = percentiles(durations)
+    result['stepsPerSecond'] = steps / durations.sum()
+    result['stages'] = latencyStats.getSummary()
+    return result
+
+def benchmarkReset(socketName, transport, envName, resets, publishRate):
+    """
+    Reset durations in lockstep mode and with a free running simulator publishing publishRate frames/s, there
+    with and without settle detection. The mock takes over a requested state in the very next frame, so the settled
+    resets only show the overhead of the detection, not how long X-Plane takes to settle.
+    """
+    result = {}
+    for mode, rate, settleReset in [('lockstep', 0, False), ('freeRunning', publishRate, False),
+                                    ('freeRunningSettled', publishRate, True)]:
+        with MockDubinsPilot(socketName, publishRate=rate):
+            env = ENVS[envName](socketName=socketName, transport=transport, lockstep=(rate == 0),
+                                settleReset=settleReset)
+            env.reset()
+            durations = np.empty(resets)
+            for idx in range(resets):
+                start = time.perf_counter()
+                env.reset()
+                durations[idx] = time.perf_counter() - start
+            env.close()
+        result[mode] = percentiles(durations)
+    return result
+
+def benchmarkWrappers(socketName, transport, envName, steps):
+    """The step durations of the bare lockstep env and of the env in the usual wrapper stack."""
+    result = {}
+    with MockDubinsPilot(socketName, publishRate=0):
+        for stack in ['bare', 'wrapped']:
+            latencyStats = LatencyStats()
+            env = ENVS[envName](socketName=socketName, transport=transport, lockstep=True, latencyStats=latencyStats)
+            if stack == 'wrapped':
+                env = wrappers.TimeLimit(env, max_episode_steps=steps + 1)
+                env = wrappers.ObservationScaler(env)
+                env = wrappers.BufferWrapper(env, 10)
+            env.reset()
+            start = time.perf_counter()
+            for _ in range(steps):
+                env.step(0.1)
+            result[stack] = {'stepMean': 1000 * (time.perf_counter() - start) / steps}
+            result[stack]['layers'] = {stage[len(WRAPPER_PREFIX):]: summary['mean'] * 1000
+                                       for stage, summary in latencyStats.getSummary().items()
+                                       if stage.startswith(WRAPPER_PREFIX)}
+            env.close()
+    result['overhead'] = result['wrapped']['stepMean'] - result['bare']['stepMean']
+    return result
+
+def printResults(results):
+    decoding = results['decoding']
+    print("\ndecoding ({} bytes/frame): {:.0f} frames/s json.loads, {:.0f} frames/s PlaneStateDecoder".format(
+        decoding['frameBytes'], decoding['jsonFramesPerSecond'], decoding['planeStateFramesPerSecond']))
+    print("throughput ({}): {:.0f} frames/s".format(results['transport'], results['throughput']['framesPerSecond']))
+    steps = results['steps']
+    print("lockstep steps: {:.0f} steps/s, ".format(steps['stepsPerSecond']) +
+          ", ".join("{} {:.3f} ms".format(q, steps[q]) for q in ['p50', 'p90', 'p99', 'p99.9', 'max']))
+    for mode, durations in results['reset'].items():
+        print("reset ({}): p50 {:.1f} ms, p99 {:.1f} ms".format(mode, durations['p50'], durations['p99']))
+    print("  (the mock settles in the first frame; settled resets against X-Plane take longer)")
+    overhead = results['wrappers']
+    print("wrappers: {:.3f} ms/step bare, {:.3f} ms/step wrapped, {:.3f} ms overhead ({})".format(
+        overhead['bare']['stepMean'], overhead['wrapped']['stepMean'], overhead['overhead'],
+        ", ".join("{} {:.3f} ms".format(layer, mean) for layer, mean in overhead['wrapped']['layers'].items())))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the envs against a local mock DubinsPilot.")
+    parser.add_argument("-t", "--transport", default='thread', choices=['thread', 'asyncio', 'process'])
+    parser.add_argument("-e", "--env", default='glideAngle', choices=sorted(ENVS))
+    parser.add_argument("--steps", type=int, default=5000, help="lockstep steps to time")
+    parser.add_argument("--frames", type=int, default=20000, help="frames to decode")
+    parser.add_argument("--resets", type=int, default=20, help="resets to time")
+    parser.add_argument("--rate", type=float, default=100.0, help="publish rate for the free running resets")
+    parser.add_argument("--extra-datarefs", type=int, default=0, dest='extraDataRefs',
+                        help="dummy datarefs added to every PLANE_STATE to emulate bigger messages")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    socketName = os.path.join(tempfile.mkdtemp(), 'eee_benchmark')
+    results = {'transport': args.transport, 'env': args.env}
+    results['decoding'] = benchmarkDecoding(args.frames, args.extraDataRefs)
+    results['throughput'] = benchmarkThroughput(socketName, args.transport, args.frames, args.extraDataRefs)
+    results['steps'] = benchmarkSteps(socketName, args.transport, args.env, args.steps)
+    results['reset'] = benchmarkReset(socketName, args.transport, args.env, args.resets, args.rate)
+    results['wrappers'] = benchmarkWrappers(socketName, args.transport, args.env, args.steps)
+    printResults(results)
+    if args.json:
+        with open(args.json, 'w') as jsonFile:
+            json.dump(results, jsonFile, indent=4)
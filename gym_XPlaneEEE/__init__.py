@@ -18,3 +18,18 @@ register(
     reward_threshold=1.0,   #TODO tbc. don't know yet
     nondeterministic = False,#TODO what does this mean
 )
+
+register(
+    id='XPlaneEEEGlideAngleSim-v0',
+    entry_point='gym_XPlaneEEE.envs:XplaneEEEGlideAngleSimEnv',
+    max_episode_steps=3000,    #this equals 300secs=5mins of simulated flight at a rate of 10/sec
+    reward_threshold=1.0,   #TODO tbc. don't know yet
+    nondeterministic = False,
+)
+
+register(
+    id='XPlaneEEEGlideAngleReplay-v0',
+    entry_point='gym_XPlaneEEE.envs:XplaneEEEGlideAngleReplayEnv',   #needs the kwarg logDirectory
+    reward_threshold=1.0,   #TODO tbc. don't know yet
+    nondeterministic = False,
+)
@@ -0,0 +1,245 @@
+import gym
+import numpy as np
+import time
+
+from gym_XPlaneEEE.utils.IpcClient import IpcClient
+from gym_XPlaneEEE.utils.asyncIpcClient import AsyncIpcClient
+from gym_XPlaneEEE.utils.processIpcClient import ProcessIpcClient, SharedStateDataCenter
+from gym_XPlaneEEE.utils.dataCenter import DataCenter, FRAME_TIMEOUT, LOCKSTEP_KEYS
+from gym_XPlaneEEE.utils.planeStateDecoder import PlaneStateDecoder
+from gym_XPlaneEEE.utils.latencyStats import SEND, WAIT, OBSERVATION, REWARD
+from gym_XPlaneEEE.utils.frameMonitor import FrameMonitor, FLAG
+from gym_XPlaneEEE.utils.fastReset import SettleDetector, SETTLE_KEYS
+
+SOCKET_NAME = "/tmp/eee_AutoViewer"
+LOCKSTEP_FRAMES_PER_STEP = 2   #simulator frames to advance per step in lockstep mode
+LOCKSTEP_TIMEOUT = 1.0  #seconds to wait for the simulator to answer a lockstep request
+
+def clamp(n, minn, maxn): return max(min(maxn, n), minn)
+
+class XplaneEEEBaseEnv(gym.Env):
+    """
+    The connection to DubinsPilot and the step plumbing shared by the XPlane envs: sending the elevator action,
+    waiting for the answering frame (free running or in lockstep), checking the freshness of the observed frame,
+    timing the step stages and seeding the initial states.
+
+    A subclass defines its spaces, implements _get_Observations(snapshot), _step_reward(observation), reset() and
+    _check_end_episode() and calls _connect() at the end of its constructor, once its DataCenter setup is done.
+    Read only observations (shared by all readers of a frame) are handed out as copies.
+
+    See XplaneEEEGlideAngleEnv for the args.
+    """
+    metadata = {'render.modes': ['human']}
+
+    def __init__(self, observationKeys, socketName=SOCKET_NAME, ipcClient=None, transport='thread',
+                 lockstep=False, framesPerStep=LOCKSTEP_FRAMES_PER_STEP, recorder=None,
+                 latencyStats=None, maxFrameAge=None, stalePolicy=FLAG, settleReset=False, initialStatePool=None):
+        super(XplaneEEEBaseEnv, self).__init__()
+        self.socketName = socketName
+        self.transport = transport
+        self.lockstep = lockstep
+        self.framesPerStep = framesPerStep
+        self.recorder = recorder
+        self.latencyStats = latencyStats
+        self.frameMonitor = FrameMonitor(maxFrameAge, stalePolicy)
+        self.stateKeys = observationKeys + LOCKSTEP_KEYS if lockstep else observationKeys
+        if settleReset:
+            self.stateKeys = self.stateKeys + SETTLE_KEYS
+        if recorder is not None:
+            self.stateKeys = self.stateKeys + recorder.stateKeyPaths   #decode what's recorded as well
+        self.initialStatePool = initialStatePool
+        self.rng = np.random.default_rng()   #see seed()
+        self.requestId = 0
+        self.simTime = 0.0
+        self.simFrame = 0
+        self.pendingFrameSeq = 0
+        self.ownsIpcClient = ipcClient is None
+        self.ipcClient = ipcClient
+        self.dc = ipcClient.dc if ipcClient is not None else \
+            SharedStateDataCenter() if transport == 'process' else DataCenter()
+        self.lockstepExtractor = self.dc.compileObservation(['simTime', 'simFrame'])
+        self.lockstepBuffer = np.zeros(2)
+        self.settleDetector = SettleDetector(self.dc) if settleReset and not lockstep else None
+        self.curr_episode = 0
+
+    def _connect(self):
+        """Connects to DubinsPilot or, with a given ipcClient, hands it the decoder, recorder and latencyStats."""
+        try:
+            if self.ownsIpcClient:
+                self._establish_connection()
+            else:
+                self.ipcClient.setStateDecoder(PlaneStateDecoder(self.stateKeys))
+                if self.recorder is not None:
+                    self.ipcClient.setRecorder(self.recorder)
+                if self.latencyStats is not None:
+                    self.ipcClient.setLatencyStats(self.latencyStats)
+        except Exception as inst:
+            print(type(inst))    # the exception instance
+            print(inst.args)     # arguments stored in .args
+            print(inst)          # __str__ allows args to be printed directly, but may be overridden in exception subclasses
+            raise inst           # re-raise the exception to higher instances TODO: is this a good idea
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.flush(wait=False)    #the owner of the recorder closes it
+        if self.ownsIpcClient and self.ipcClient is not None:
+            self.ipcClient.setContinueFlag(False)   #make the ipcListener stop
+            self.ipcClient = None
+
+    def _establish_connection(self):
+        #start a listener thread
+        if self.transport == 'asyncio':
+            self.ipcClient = AsyncIpcClient(self.dc)
+        elif self.transport == 'thread':
+            self.ipcClient = IpcClient(self.dc)
+        elif self.transport == 'process':
+            self.ipcClient = ProcessIpcClient(self.dc)
+        else:
+            raise ValueError("Unknown transport {}. Use 'thread', 'asyncio' or 'process'.".format(self.transport))
+        self.ipcClient.connect(self.socketName)
+        self.ipcClient.setStateDecoder(PlaneStateDecoder(self.stateKeys))  #only decode what's needed for the observations
+        if self.recorder is not None:
+            self.ipcClient.setRecorder(self.recorder)
+        if self.latencyStats is not None:
+            self.ipcClient.setLatencyStats(self.latencyStats)
+        self.ipcClient.daemon = True    #like seen on https://www.geeksforgeeks.org/python-different-ways-to-kill-a-thread/
+        self.ipcClient.start()
+
+    def step(self, action):
+        """
+
+        Parameters
+        ----------
+        action (float): is the value of the elevator in the ranges [-1:1] as continuous float
+
+        Returns
+        -------
+        ob, reward, episode_over, info : tuple
+            ob (object) :
+                an environment-specific object representing your observation of
+                the environment.
+            reward (float) :
+                amount of reward achieved by the previous action. The scale
+                varies between environments, but the goal is always to increase
+                your total reward.
+            episode_over (bool) :
+                whether it's time to reset the environment again. Most (but not
+                all) tasks are divided up into well-defined episodes, and done
+                being True indicates the episode has terminated. (For example,
+                perhaps the pole tipped too far, or you lost your last life.)
+            info (dict) :
+                 diagnostic information useful for debugging. It can sometimes
+                 be useful for learning (for example, it might contain the raw
+                 probabilities behind the environment's last state change).
+                 However, official evaluations of your agent are not allowed to
+                 use this for learning.
+        """
+        self._take_action(action)
+        info = self._await_response() if self.lockstep else {}
+        return self._finish_step(info)
+
+    def step_async(self, action):
+        """
+        Sends the action without waiting for the simulator to respond, so the caller can do other work (e. g. a
+        gradient update) in the meantime. Collect the result with step_wait().
+        """
+        self.pendingFrameSeq = self.dc.frameSeq
+        self._take_action(action)
+
+    def step_wait(self):
+        """
+        Blocks until the first frame received after the action of step_async() was sent (in lockstep mode: the frame
+        acknowledging it) and returns like step(). info['timeout'] is set if no such frame arrived in time.
+        """
+        return self._finish_step(self._await_response())
+
+    def _await_response(self):
+        """Waits for the frame answering the last action (see step_wait()) and returns the info dict of the step."""
+        start = time.perf_counter()
+        if self.lockstep:
+            info = self._lockstep_info(self._await_lockstep_ack())
+        else:
+            info = {} if self.dc.waitForFrame(self.pendingFrameSeq + 1, FRAME_TIMEOUT) else {'timeout': True}
+        if self.latencyStats is not None:
+            self.latencyStats.record(WAIT, time.perf_counter() - start)
+        return info
+
+    def getLatencyStatistics(self):
+        """Returns the summary of the step stage latencies (see LatencyStats.getSummary()); None if not timed."""
+        return self.latencyStats.getSummary() if self.latencyStats is not None else None
+
+    def getFrameStatistics(self):
+        """Returns the counts of repeated, skipped and stale frames and the frame ages (see FrameMonitor.getSummary())."""
+        return self.frameMonitor.getSummary()
+
+    def _finish_step(self, info):
+        #observe the very frame the monitor judged
+        snapshot = self.frameMonitor.check(self.dc, info, self.dc.getSnapshot())
+        start = time.perf_counter()
+        obs = self._get_Observations(snapshot)
+        observed = time.perf_counter()
+        self.reward = self._step_reward(obs)
+        if self.latencyStats is not None:
+            self.latencyStats.record(OBSERVATION, observed - start)
+            self.latencyStats.record(REWARD, time.perf_counter() - observed)
+        episode_over = self._check_end_episode()    #TODO
+        return self._hand_out(obs), self.reward, episode_over, info
+
+    def _hand_out(self, obs):
+        """A writable copy of a read only (shared) observation; other observations as they are."""
+        return obs if obs.flags.writeable else obs.copy()
+
+    def _get_Observations(self, snapshot=None):
+        """The observation of the latest frame or the frame of snapshot."""
+        raise NotImplementedError
+
+    def _step_reward(self, obs):
+        """The reward of a step observing obs. May note obs as the current observation of the env."""
+        raise NotImplementedError
+
+    def _take_action(self, action):
+        start = time.perf_counter()
+        action = float(action)  # convert the np.array[float32] to a single float value
+        clamp(action, -1.0, +1.0)
+        # prepare the entire message to be sent out to the DubinsPilot socket
+        ctrlDict = {}
+        ctrlDict['yoke_pitch_ratio'] = action  #action is a numpy.array with a single element
+        if self.recorder is not None:
+            self.recorder.recordAction(action, self.requestId + 1 if self.lockstep else 1)
+        if self.lockstep:
+            self.requestId += 1
+            ctrlDict['advanceFrames'] = self.framesPerStep
+        sent = self.ipcClient.socketSendData('SET_ELEVATOR', self.requestId if self.lockstep else 1, ctrlDict)
+        if self.latencyStats is not None:
+            self.latencyStats.record(SEND, time.perf_counter() - start)
+        return sent
+
+    def _await_lockstep_ack(self):
+        """
+        Blocks until the PLANE_STATE answering the last lockstep request arrived and notes its simulation time.
+        Returns False on timeout.
+        """
+        acked = self.dc.awaitRequestAck(self.requestId, LOCKSTEP_TIMEOUT)
+        self.simTime, self.simFrame = self.lockstepExtractor.extract(self.lockstepBuffer)
+        return acked
+
+    def _lockstep_info(self, acked):
+        info = {'simTime': self.simTime, 'simFrame': int(self.simFrame)}
+        if not acked:
+            info['timeout'] = True
+        return info
+
+    def seed(self, seed=None):
+        return self._seed(seed)
+
+    def _seed(self, seed=None):
+        """
+        Seeds the generator of the initial plane states. Returns the list holding the seed used (the drawn entropy
+        if seed is None).
+        """
+        seedSequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(seedSequence)
+        return [seedSequence.entropy]
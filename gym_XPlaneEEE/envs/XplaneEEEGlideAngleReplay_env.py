@@ -0,0 +1,155 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from gym_XPlaneEEE.envs.XplaneEEEGlideAngle_env import XplaneEEEGlideAngleEnv, glide_angle_observations, glide_angle_reward
+from gym_XPlaneEEE.utils.dataCenter import GLIDE_ANGLE_STATE_KEYS
+from gym_XPlaneEEE.utils.telemetryRecorder import TelemetryLog, columnName
+
+import logging
+logger = logging.getLogger(__name__)
+
+def replayObservationsAndRewards(log):
+    """
+    Calculates the observations and rewards of the XplaneEEEGlideAngleEnv for every recorded state at once.
+    Useful to relabel the rewards of large datasets. The memory mapped chunks are processed one by one, so only
+    the results are held in memory.
+
+    Args
+    ----
+    log: a TelemetryLog (or the directory of one) holding the GLIDE_ANGLE_STATE_KEYS in its states table
+
+    Returns
+    -------
+    timestamps, observations, rewards : arrays of shape (N,), (N, 5) and (N,)
+    """
+    if not isinstance(log, TelemetryLog):
+        log = TelemetryLog(log)
+    columns = log.columns('states')
+    missing = [columnName(key) for key in GLIDE_ANGLE_STATE_KEYS if columnName(key) not in columns]
+    if missing:
+        raise ValueError("The telemetry log lacks the state values {}".format(missing))
+    keyColumns = [columns.index(columnName(key)) for key in GLIDE_ANGLE_STATE_KEYS]
+    chunks = log.chunks('states')
+    rows = sum(len(chunk) for chunk in chunks)
+    timestamps = np.empty(rows)
+    obs = np.empty((rows, 5))
+    rewards = np.empty(rows)
+    start = 0
+    for chunk in chunks:
+        end = start + len(chunk)
+        Qrad, yoke_pitch_ratio, tas, Vh_ind, requestedClimbRate = [chunk[:, idx] for idx in keyColumns]
+        obs[start:end] = glide_angle_observations(Qrad, yoke_pitch_ratio, tas, Vh_ind, requestedClimbRate)
+        rewards[start:end] = glide_angle_reward(obs[start:end, 3], obs[start:end, 2], obs[start:end, 4])
+        timestamps[start:end] = chunk[:, columns.index('timestamp')]
+        start = end
+    return timestamps, obs, rewards
+
+class XplaneEEEGlideAngleReplayEnv(XplaneEEEGlideAngleEnv):
+    """
+    Serves flights recorded by a TelemetryRecorder with the observations and rewards of the XplaneEEEGlideAngleEnv.
+
+    Each recorded action is one step and every recorded episode is one episode of the replay. The first action of
+    an episode is the elevator reset sent by XplaneEEEGlideAngleEnv.reset() and doesn't count as a step.
+    The observation of a step is the one the recording env returned: the latest state when the action was sent
+    or, for flights recorded in lockstep mode, the state answering the action (the last one before the next action).
+
+    In 'openLoop' mode, the recorded steps are replayed in order and the given actions are ignored.
+    In 'nearest' mode, the step continues with the recorded response to the recorded (observation, action) pair
+    that is nearest to the current observation and the given action. The distance is measured on features scaled
+    to unit standard deviation, searched in a KD-tree.
+
+    All observations and rewards are calculated once when the env is created, so stepping is as fast as indexing.
+
+    Args
+    ----
+    :param logDirectory: the directory written by the TelemetryRecorder
+
+    :param mode = 'openLoop': 'openLoop' or 'nearest'
+
+    :param lockstep = False: whether the flights were recorded in lockstep mode
+    """
+    def __init__(self, logDirectory, mode='openLoop', lockstep=False):
+        if mode not in ('openLoop', 'nearest'):
+            raise ValueError("Unknown mode {}. Use 'openLoop' or 'nearest'.".format(mode))
+        #no call to the parent constructor as there is no connection to establish
+        self.mode = mode
+        self.curr_episode = 0
+        self.reward = 0
+        self._define_spaces()
+        self.log = TelemetryLog(logDirectory)
+        stateTimes, stateObs, stateRewards = replayObservationsAndRewards(self.log)
+        actionTimes = self.log.column('actions', 'timestamp')
+        #the recorded episodes as ranges of actions; the first action of each is the elevator reset
+        episodeTimes = self.log.column('episodes', 'timestamp')
+        starts = np.unique(np.searchsorted(actionTimes, episodeTimes))
+        ends = np.append(starts[1:], len(actionTimes))
+        keep = ends - starts >= 2   #episodes without any step can't be replayed
+        starts, ends = starts[keep], ends[keep]
+        if not len(starts):
+            raise ValueError("The telemetry log in {} holds no episodes to replay".format(logDirectory))
+        isStep = np.zeros(len(actionTimes), dtype=bool)
+        for start, end in zip(starts, ends):
+            isStep[start + 1:end] = True
+        steps = np.flatnonzero(isStep)
+        #the state the env returned after each action
+        if lockstep:
+            observedAt = np.append(actionTimes[1:], np.inf)
+        else:
+            observedAt = actionTimes
+        obsIdx = np.maximum(np.searchsorted(stateTimes, observedAt, side='right') - 1, 0)
+        self.observations = stateObs[obsIdx[steps]]
+        self.rewards = stateRewards[obsIdx[steps]]
+        self.recordedActions = self.log.column('actions', 'yoke_pitch_ratio')[steps]
+        #the step index ranges of the episodes and the observation returned by their reset
+        self.episodeStarts = np.searchsorted(steps, starts + 1)
+        self.episodeEnds = np.searchsorted(steps, ends)
+        self.resetObservations = stateObs[obsIdx[starts]] if lockstep else \
+            stateObs[np.maximum(np.searchsorted(stateTimes, actionTimes[starts + 1], side='right') - 1, 0)]
+        self.episodeOfStep = np.searchsorted(self.episodeStarts, np.arange(len(steps)), side='right') - 1
+        #the observation the agent acted on in each step; features to find the nearest transition in 'nearest' mode
+        preObservations = np.vstack((self.resetObservations[:1], self.observations[:-1]))
+        preObservations[self.episodeStarts] = self.resetObservations
+        transitionFeatures = np.hstack((preObservations, self.recordedActions[:, np.newaxis]))
+        self.featureScale = transitionFeatures.std(axis=0)
+        self.featureScale[self.featureScale == 0] = 1.0
+        self.transitionTree = cKDTree(transitionFeatures / self.featureScale) if mode == 'nearest' else None
+        self.episodeIdx = -1
+        self.stepIdx = 0
+        self.pendingAction = 0.0
+
+    def close(self):
+        pass
+
+    def reset(self):
+        """Starts the next recorded episode and returns its first observation."""
+        self.curr_step = -1
+        self.curr_episode += 1
+        self.episodeIdx = (self.episodeIdx + 1) % len(self.episodeStarts)
+        self.stepIdx = self.episodeStarts[self.episodeIdx]
+        self.glideAngleObservation = self.resetObservations[self.episodeIdx]
+        return self.glideAngleObservation.copy()   #a view would let the agent write into the table
+
+    def step(self, action):
+        """see XplaneEEEGlideAngleEnv.step(); info['recordedAction'] holds the action recorded for this step"""
+        if self.mode == 'nearest':
+            feature = np.append(self.glideAngleObservation, np.squeeze(action))
+            self.stepIdx = int(self.transitionTree.query(feature / self.featureScale)[1])
+            self.episodeIdx = self.episodeOfStep[self.stepIdx]
+        self.glideAngleObservation = self.observations[self.stepIdx]
+        self.reward = self.rewards[self.stepIdx]
+        info = {'recordedAction': self.recordedActions[self.stepIdx]}
+        self.stepIdx += 1
+        episode_over = self.stepIdx >= self.episodeEnds[self.episodeIdx]
+        return self.glideAngleObservation.copy(), self.reward, episode_over, info
+
+    def step_async(self, action):
+        self.pendingAction = action
+
+    def step_wait(self):
+        return self.step(self.pendingAction)
+
+    def fakeStep(self, action):
+        return self.step(action)
+
+    def _get_Observations(self):
+        return self.glideAngleObservation
@@ -0,0 +1,107 @@
+import numpy as np
+
+from gym_XPlaneEEE.envs.XplaneEEEGlideAngle_env import XplaneEEEGlideAngleEnv, DESIRED_GLIDE_ANGLE, clamp, glide_angle_observations
+from gym_XPlaneEEE.utils import flightModel
+from gym_XPlaneEEE.utils.xPlaneGymCalculations import prepareInitialPlaneState, AOA_AVG
+
+import logging
+logger = logging.getLogger(__name__)
+
+STEP_TIME = 0.1     #seconds of simulated flight per step; matches the 10 actions per second used with XPlane
+# gains of the PID controller standing in for the one of DubinsPilot in fakeStep(), on the glide angle deviation [rad]
+PID_P = 4.0
+PID_I = 1.0
+PID_D = 2.0     #on the pitch rate [rad/s]
+
+class XplaneEEEGlideAngleSimEnv(XplaneEEEGlideAngleEnv):
+    """
+    In-process surrogate of the XplaneEEEGlideAngleEnv.
+
+    Instead of talking to DubinsPilot, a simplified longitudinal model of the Cessna 172 (see flightModel) is
+    integrated for STEP_TIME seconds per step. Observation and action spaces as well as the reward are the ones
+    of the XplaneEEEGlideAngleEnv; the initial states are drawn by prepareInitialPlaneState().
+
+    This is meant for pre-training and smoke tests of policies, not as a replacement for XPlane.
+    """
+    def __init__(self, targetGlideAngle=DESIRED_GLIDE_ANGLE, stepTime=STEP_TIME):
+        """
+        Args
+        ----
+        :param targetGlideAngle = DESIRED_GLIDE_ANGLE: the glide angle to be maintained [deg]; in XPlane, this is
+        the requestedClimbRate set in DubinsPilot
+
+        :param stepTime = STEP_TIME: the seconds of simulated flight per step
+        """
+        #no call to the parent constructor as there is no connection to establish
+        self.curr_episode = 0
+        self.reward = 0
+        self.targetGlideAngle = targetGlideAngle
+        self.stepTime = stepTime
+        self.simTime = 0.0
+        self.state = np.zeros(flightModel.STATE_SIZE)
+        self.yoke = 0.0
+        self.pidIntegral = 0.0
+        self.pendingAction = 0.0
+        self.rng = np.random.default_rng()   #see seed()
+        self._define_spaces()
+
+    def close(self):
+        pass
+
+    def step(self, action):
+        """see XplaneEEEGlideAngleEnv.step()"""
+        self._take_action(action)
+
+        obs = self._get_Observations()
+        self.glideAngleObservation = obs
+        self.reward = self._get_reward(obs[3], obs[2], obs[4])
+
+        episode_over = self._check_end_episode()
+        return self.glideAngleObservation, self.reward, episode_over, {'simTime': self.simTime}
+
+    def step_async(self, action):
+        """There is nothing to wait for in the simulation; the step is done in step_wait()."""
+        self.pendingAction = action
+
+    def step_wait(self):
+        return self.step(self.pendingAction)
+
+    def fakeStep(self, action):
+        """
+        see XplaneEEEGlideAngleEnv.fakeStep(); a PID controller on the glide angle deviation stands in for the one of
+        DubinsPilot. The action is ignored, the yoke set by the controller is returned in obs[4].
+        """
+        obs = self._get_Observations()
+        angleDeviation, qrad = obs[3], obs[2]
+        self.pidIntegral = clamp(self.pidIntegral + angleDeviation * self.stepTime, -1.0, +1.0)
+        #pushing steepens the glide
+        return self.step(-PID_P * angleDeviation - PID_I * self.pidIntegral - PID_D * qrad)
+
+    def _take_action(self, action):
+        self.yoke = clamp(float(np.squeeze(action)), -1.0, +1.0)
+        self.state = flightModel.integrate(self.state, self.yoke, self.stepTime)
+        self.simTime += self.stepTime
+        return True
+
+    def _get_Observations(self):
+        """see XplaneEEEGlideAngleEnv._get_Observations()"""
+        tas = self.state[flightModel.V]
+        Vh_ind = tas * np.sin(self.state[flightModel.GAMMA])
+        return glide_angle_observations(self.state[flightModel.Q], self.yoke, tas, Vh_ind, self.targetGlideAngle)
+
+    def _check_end_episode(self):
+        """The episode ends when the plane hits the ground or the model left its valid range."""
+        if self.state[flightModel.H] <= 0 or self.state[flightModel.V] <= 1.0:
+            return True
+        return not np.all(np.isfinite(self.state))
+
+    def reset(self):
+        """see XplaneEEEGlideAngleEnv.reset()"""
+        self.curr_step = -1
+        self.curr_episode += 1
+        self.simTime = 0.0
+        self.yoke = 0.0
+        self.pidIntegral = 0.0
+        newPlaneState = prepareInitialPlaneState(rng=self.rng)
+        self.state = flightModel.stateFromPlaneState(newPlaneState['data'], np.deg2rad(AOA_AVG))
+        return self._get_Observations()
@@ -1,13 +1,14 @@
 
-import gym
 from gym import spaces
 # from gym import utils
 # from gym.utils import seeding
 import numpy as np
 import datetime
 
-from gym_XPlaneEEE.utils.IpcClient import IpcClient
-from gym_XPlaneEEE.utils.dataCenter import DataCenter
+from gym_XPlaneEEE.envs.XplaneEEEBase_env import XplaneEEEBaseEnv, SOCKET_NAME, LOCKSTEP_FRAMES_PER_STEP, clamp
+from gym_XPlaneEEE.utils.dataCenter import GLIDE_ANGLE_STATE_KEYS
+from gym_XPlaneEEE.utils.frameMonitor import FLAG
+from gym_XPlaneEEE.utils.derivedFeatures import glideAngleDeviation
 from gym_XPlaneEEE.utils.xPlaneGymCalculations import prepareInitialPlaneState
 
 
@@ -16,24 +17,83 @@ logger = logging.getLogger(__name__)
 
 MAX_EPISODE_LENGTH = 90    #end the episode after 90 seconds
 MAX_ALLOWED_DEVIATION = 10 #end the episode when the glide angle is further away then 10° from the setpoint
-SOCKET_NAME = "/tmp/eee_AutoViewer"
 DESIRED_GLIDE_ANGLE = -6  #just a first guess
 PUNISHMENT_STALL = -1   #TODO compare with the speed punishment and scale accordingly
+GLIDE_ANGLE_OBSERVATION = 'glideAngleObservation'   #the derived feature holding the observation
 
-def clamp(n, minn, maxn): return max(min(maxn, n), minn)
 def knots_in_ms(knots): return  knots * 0.51444444444
 def ms_in_knots(ms): return  ms / 0.51444444444
 
-class XplaneEEEGlideAngleEnv(gym.Env):
-    metadata = {'render.modes': ['human']}
+def glide_angle_observations(Qrad, yoke_pitch_ratio, tas, Vh_ind, requestedClimbRate):
+    """
+    Calculates the observations (see XplaneEEEGlideAngleEnv._get_Observations()) from the raw state values.
+    Works on arrays of states as well; the observations are stacked in the last axis then.
+    """
+    angleDeviation = glideAngleDeviation(tas, Vh_ind, requestedClimbRate)
+    obs = np.zeros(np.shape(angleDeviation) + (5,))
+    obs[..., 0] = np.sin(angleDeviation)
+    obs[..., 1] = np.cos(angleDeviation)
+    obs[..., 2] = Qrad
+    obs[..., 3] = angleDeviation
+    obs[..., 4] = yoke_pitch_ratio
+    return obs
 
-    def __init__(self):
-        super(XplaneEEEGlideAngleEnv, self).__init__()
-        self.dc = DataCenter.instance()
-        self.ipcClient = None
-        self.curr_episode = 0
+def glide_angle_reward(angleDeviation, qrad, actuation):
+    """see XplaneEEEGlideAngleEnv._get_reward(); works on arrays as well"""
+    cost = 10*angleDeviation**2 + 0.1*qrad**2 + 0.1*actuation**2
+    return -cost
+
+class XplaneEEEGlideAngleEnv(XplaneEEEBaseEnv):
+    def __init__(self, socketName=SOCKET_NAME, ipcClient=None, transport='thread',
+                 lockstep=False, framesPerStep=LOCKSTEP_FRAMES_PER_STEP, recorder=None,
+                 latencyStats=None, maxFrameAge=None, stalePolicy=FLAG, settleReset=False, initialStatePool=None):
+        """
+        Args
+        ----
+        :param socketName = SOCKET_NAME: the socket of the DubinsPilot instance to connect to.
+        Can be given as kwarg to gym.make() to run several simulators from one process.
+
+        :param ipcClient = None: an already connected and started IpcClient/AsyncIpcClient/ProcessIpcClient to use instead of
+        creating a new connection. The env then reads the plane state from the client's DataCenter and
+        leaves closing the connection to the caller.
+
+        :param transport = 'thread': 'thread' listens to DubinsPilot with the IpcClient thread,
+        'asyncio' uses an AsyncIpcClient on the event loop shared by all asyncio connections,
+        'process' reads the socket in a separate process with the ProcessIpcClient (no recording).
+
+        :param lockstep = False: drive the simulation by frames instead of wall clock. Every action asks the
+        simulator to advance framesPerStep frames and step() returns as soon as the matching PLANE_STATE arrives.
+        The info dict then holds 'simTime' and 'simFrame' of the observation.
+
+        :param framesPerStep = LOCKSTEP_FRAMES_PER_STEP: the simulator frames to advance per step in lockstep mode
+
+        :param recorder = None: a TelemetryRecorder recording every received state, every action, the initial
+        states set by reset() and the episode boundaries (opt-in); its stateKeys are decoded in addition
+
+        :param latencyStats = None: a LatencyStats timing the stages of every step (see getLatencyStatistics())
+
+        :param maxFrameAge = None: the age [s] from which on an observed frame is stale. The info dict of every
+        step holds 'frameSeq', 'frameAge', 'skippedFrames' and 'repeatedFrame' of the observed frame and
+        'staleFrame' if it is stale (see FrameMonitor and getFrameStatistics()).
+
+        :param stalePolicy = FLAG: FLAG ('flag') only marks stale frames, WAIT ('wait') waits for a fresh frame first
+
+        :param settleReset = False: reset() returns as soon as the plane has settled in the new initial state
+        (see SettleDetector) instead of after a fixed number of frames; ignored in lockstep mode
+
+        :param initialStatePool = None: an InitialStatePool to draw the initial states from instead of sampling
+        them in reset(); may be shared by several envs
+        """
+        super(XplaneEEEGlideAngleEnv, self).__init__(GLIDE_ANGLE_STATE_KEYS, socketName, ipcClient, transport,
+                                                     lockstep, framesPerStep, recorder, latencyStats, maxFrameAge,
+                                                     stalePolicy, settleReset, initialStatePool)
+        self.dc.derivedFeatures.register(GLIDE_ANGLE_OBSERVATION, GLIDE_ANGLE_STATE_KEYS, glide_angle_observations)
         self.reward = 0
         self.targetGlideAngle = DESIRED_GLIDE_ANGLE
+        self._define_spaces()
+        self._connect()
+
+    def _define_spaces(self):
         # Define action and observation space
         #- yoke_pitch_ratio
         self.action_space = spaces.Box(-1, 1, shape = (1,), dtype=np.float32)
@@ -61,65 +121,10 @@ class XplaneEEEGlideAngleEnv(gym.Env):
 
         self.observation_space = spaces.Box(low=np.array([-1.0, -1.0, -20.0, -3.14, -1.0]), 
                                            high=np.array([ 1.0,  1.0,  20.0,  3.14,  1.0]), dtype=np.float32)
-        try: 
-            self._establish_connection()
-        except Exception as inst:
-            print(type(inst))    # the exception instance
-            print(inst.args)     # arguments stored in .args
-            print(inst)          # __str__ allows args to be printed directly, but may be overridden in exception subclasses
-            raise inst           # re-raise the exception to higher instances TODO: is this a good idea
-
-    def __del__(self):
-        self.ipcClient.setContinueFlag(False)   #make the ipcListener stop
-
-    def _establish_connection(self):
-        #start a listener thread
-        self.ipcClient = IpcClient.instance()
-        self.ipcClient.connect(SOCKET_NAME)
-        self.ipcClient.daemon = True    #like seen on https://www.geeksforgeeks.org/python-different-ways-to-kill-a-thread/
-        self.ipcClient.start()
-
-    def step(self, action):
-        """
-
-        Parameters
-        ----------
-        action (float): is the value of the elevator in the ranges [-1:1] as continuous float 
-
-        Returns
-        -------
-        ob, reward, episode_over, info : tuple
-            ob (object) :
-                an environment-specific object representing your observation of
-                the environment.
-            reward (float) :
-                amount of reward achieved by the previous action. The scale
-                varies between environments, but the goal is always to increase
-                your total reward.
-            episode_over (bool) :
-                whether it's time to reset the environment again. Most (but not
-                all) tasks are divided up into well-defined episodes, and done
-                being True indicates the episode has terminated. (For example,
-                perhaps the pole tipped too far, or you lost your last life.)
-            info (dict) :
-                 diagnostic information useful for debugging. It can sometimes
-                 be useful for learning (for example, it might contain the raw
-                 probabilities behind the environment's last state change).
-                 However, official evaluations of your agent are not allowed to
-                 use this for learning.
-        """
-        self._take_action(action)
 
-        obs = self._get_Observations()
-        self.glideAngleObservation = obs
-        self.reward = self._get_reward(obs[3], obs[2], obs[4])
-
-        episode_over = self._check_end_episode()    #TODO
-        return self.glideAngleObservation, self.reward, episode_over, {}
-
-    def _get_Observations(self):
+    def _get_Observations(self, snapshot=None):
         """
-        Observations are:
+        Observations of the latest frame (or the frame of snapshot) are:
         obs[0]: sin(angleDeviation)
         obs[1]: cos(angleDeviation)
         obs[2]: Qrad (i. e. ThetaDot /rad)
@@ -127,23 +132,15 @@ class XplaneEEEGlideAngleEnv(gym.Env):
         obs[4]: yoke_pitch_ratio (of last action)
         # obs[5]: stall Warning
         # obs[6]: true Airspeed [m/s range 0...120]
+
+        The observation is computed once per frame and shared by all readers, so the returned array is read only.
+        step(), fakeStep() and reset() hand out writable copies.
         """
+        return self.dc.getDerived(GLIDE_ANGLE_OBSERVATION, snapshot)
 
-        keyList = [None, None, 'Qrad', None, 'yoke_pitch_ratio']
-        obs = self.dc.getObservation(keyList)
-        tas, Vh_ind = self.dc.getObservation(['true_airspeed','vh_ind'])
-        glideAngleRad = 0.0
-        if tas != 0:
-            #wir müssen den Gleitwinkel selber rechnen aus true_airspeed und sinkrate
-            #der von XPlane ausgegebene Winkel ist bezogen auf ground_speed und damit bei Wind unbrauchbar.
-            glideAngleRad = np.arctan(Vh_ind/tas)  #in radians
-        # glideAngleRad = np.deg2rad(self.dc.getObservation(['true_theta']))
-        targetGlideAngle = np.deg2rad(self.dc.getObservation([['targetValues','requestedClimbRate']])[0])
-        angleDeviation = glideAngleRad - targetGlideAngle
-        obs[0] = np.sin(angleDeviation)
-        obs[1] = np.cos(angleDeviation)
-        obs[3] = angleDeviation
-        return obs
+    def _step_reward(self, obs):
+        self.glideAngleObservation = obs
+        return self._get_reward(obs[3], obs[2], obs[4])
 
     def fakeStep(self, action):
         """
@@ -179,19 +176,10 @@ class XplaneEEEGlideAngleEnv(gym.Env):
         # self._take_action(action)
 
         obs = self._get_Observations()
-        self.glideAngleObservation = obs
-        self.reward = self._get_reward(obs[3], obs[2], obs[4])
+        self.reward = self._step_reward(obs)
 
         episode_over = self._check_end_episode()    #TODO
-        return self.glideAngleObservation, self.reward, episode_over, {}
-
-    def _take_action(self, action):
-        action = float(action)  # convert the np.array[float32] to a single float value
-        clamp(action, -1.0, +1.0)
-        # prepare the entire message to be sent out to the DubinsPilot socket
-        ctrlDict = {}
-        ctrlDict['yoke_pitch_ratio'] = action  #action is a numpy.array with a single element
-        self.ipcClient.socketSendData('SET_ELEVATOR', 1, ctrlDict)
+        return self._hand_out(obs), self.reward, episode_over, {}
 
     def _check_end_episode(self):
         """
@@ -226,19 +214,37 @@ class XplaneEEEGlideAngleEnv(gym.Env):
         self.curr_step = -1
         self.curr_episode += 1
         self.startOfEpisode = datetime.datetime.now()
+        if self.recorder is not None:
+            self.recorder.recordEpisodeStart(self.curr_episode)
         waitingSteps = 10
         # calculate new initial plane state
-        newPlaneState = prepareInitialPlaneState()
-        # set initial plane state
+        newPlaneState = self.initialStatePool.draw() if self.initialStatePool is not None else \
+            prepareInitialPlaneState(rng=self.rng)
+        # set initial plane state; count the frames from here on
+        resetSeq = self.dc.frameSeq
         if self.ipcClient.socketSendData("SET_PLANE_STATE", 1, newPlaneState['data']):
+            if self.recorder is not None:
+                self.recorder.recordPlaneState(newPlaneState['data'])
             self._take_action(0.0)  #reset the elevator to 0
+            if self.lockstep:
+                #the simulation doesn't move on its own; the elevator reset above advances it to the new state
+                if not self._await_lockstep_ack():
+                    return None #timeout ocurred
+                self.frameMonitor.restart(self.dc)
+                return self._get_Observations().copy()
+            if self.settleDetector is not None:
+                #done as soon as the new state is there, but never waiting longer than without settle detection
+                if self.settleDetector.waitUntilSettled(newPlaneState['data'], resetSeq, waitingSteps) is None:
+                    return None #timeout ocurred
+                self.frameMonitor.restart(self.dc)
+                return self._get_Observations().copy()
             #get the first observation after changing the plane's state
             print("Waiting for first {} observations after RESET".format(waitingSteps))
-            for i in range(waitingSteps):
-                if not self.dc.awaitNextObservation():  #block until a new observation is sent from XPlane
-                    # raise ConnectionError("Didn't receive any new Observations within one second. Check Connection to XPlane!")
-                    return None #timeout ocurred
-            return self._get_Observations()
+            if not self.dc.waitForNFrames(waitingSteps, since=resetSeq):  #block until enough observations are sent from XPlane
+                # raise ConnectionError("Didn't receive any new Observations within one second. Check Connection to XPlane!")
+                return None #timeout ocurred
+            self.frameMonitor.restart(self.dc)
+            return self._get_Observations().copy()
         else:
             return None
 
@@ -249,9 +255,6 @@ class XplaneEEEGlideAngleEnv(gym.Env):
         self.glideAngleObservation = self._get_Observations()
         print(f'current Deviation: {self.glideAngleObservation[3]}; current Qrad: {self.glideAngleObservation[2]}; reward: {self.reward};')
     
-    def _seed(self):
-        pass
-
     # def _calculate_glide_angle_deviation(self, angle):
     #     """
     #     calculates absolute value deviation of the current state from the desired glide angle
@@ -274,5 +277,4 @@ class XplaneEEEGlideAngleEnv(gym.Env):
           #TODO - when the stall warning is active.
           #TODO - for the smoothness of the actuation
         """
-        cost = 10*angleDeviation**2 + 0.1*qrad**2 + 0.1*actuation**2
-        return -cost
+        return glide_angle_reward(angleDeviation, qrad, actuation)
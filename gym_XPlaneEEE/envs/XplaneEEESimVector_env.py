@@ -0,0 +1,149 @@
+from gym import spaces
+import numpy as np
+
+from gym_XPlaneEEE.envs.XplaneEEEGlideAngle_env import DESIRED_GLIDE_ANGLE, glide_angle_observations, glide_angle_reward
+from gym_XPlaneEEE.envs.XplaneEEESpeed_env import speed_reward
+from gym_XPlaneEEE.envs.XplaneEEEGlideAngleSim_env import STEP_TIME
+from gym_XPlaneEEE.utils import flightModel
+from gym_XPlaneEEE.utils.xPlaneGymCalculations import drawInitialPlaneStates, planeStateDataRefs, AOA_AVG
+
+import logging
+logger = logging.getLogger(__name__)
+
+FEET_PER_METER = 3.28084
+
+class XplaneEEESimVectorEnv(object):
+    """
+    Batched surrogate simulator flying num_envs aircraft at once.
+
+    The states of all aircraft are kept in one contiguous (num_envs, STATE_SIZE) array and advanced by
+    vectorized calls of flightModel.integrate(). Observations, rewards and the interface match the ones of the
+    XplaneEEEVectorEnv with either XplaneEEEGlideAngleEnv ('glideAngle') or XplaneEEESpeedEnv ('speed')
+    sub-environments. Aircraft whose episode is over (ground contact, invalid state or maxEpisodeSteps) are
+    reset automatically; info['terminal_observation'] holds their last observation.
+
+    Args
+    ----
+    :param num_envs: the number of aircraft
+
+    :param task = 'glideAngle': 'glideAngle' or 'speed'
+
+    :param targetGlideAngle = DESIRED_GLIDE_ANGLE: the glide angle to be maintained in the glideAngle task [deg]
+
+    :param stepTime = STEP_TIME: the seconds of simulated flight per step
+
+    :param maxEpisodeSteps = 3000: the steps after which an episode is over; None for no limit
+
+    :param seed = None: the seed of the generator of the initial states (see seed())
+    """
+    def __init__(self, num_envs, task='glideAngle', targetGlideAngle=DESIRED_GLIDE_ANGLE,
+                 stepTime=STEP_TIME, maxEpisodeSteps=3000, seed=None):
+        if task not in ('glideAngle', 'speed'):
+            raise ValueError("Unknown task {}. Use 'glideAngle' or 'speed'.".format(task))
+        self.num_envs = num_envs
+        self.task = task
+        self.targetGlideAngle = targetGlideAngle
+        self.stepTime = stepTime
+        self.maxEpisodeSteps = maxEpisodeSteps
+        self.state = np.zeros((num_envs, flightModel.STATE_SIZE))
+        self.phi = np.zeros(num_envs)   #there is no lateral motion; the roll stays at its initial value
+        self.yoke = np.zeros(num_envs)
+        self.elapsedSteps = np.zeros(num_envs, dtype=np.int64)
+        self.pendingActions = None
+        self.seed(seed)
+        if task == 'glideAngle':
+            self.action_space = spaces.Box(-1, 1, shape = (1,), dtype=np.float32)
+            self.observation_space = spaces.Box(low=np.array([-1.0, -1.0, -20.0, -3.14, -1.0]),
+                                               high=np.array([ 1.0,  1.0,  20.0,  3.14,  1.0]), dtype=np.float32)
+        else:
+            self.action_space = spaces.Box(low=np.array([-1.0]), high=np.array([1.0]))
+            self.observation_space = spaces.Box(low=np.array([0.0,   0.0,     0.0,  10.0, -30.0, -1.0, -90.0, -1.0]),
+                                               high=np.array([120.0, 1.0, 15000.0, +10.0, +30.0, +1.0, +90.0, +1.0]), dtype=np.float32)
+
+    def _reset_envs(self, idx):
+        """Draws new initial states for the aircraft with the given indices."""
+        dataRefs = planeStateDataRefs(drawInitialPlaneStates(len(idx), self.rng))
+        self.state[idx] = flightModel.stateFromPlaneState(dataRefs, np.deg2rad(AOA_AVG))
+        self.phi[idx] = flightModel.rollFromPlaneState(dataRefs)
+        self.yoke[idx] = 0.0
+        self.elapsedSteps[idx] = 0
+
+    def seed(self, seed=None):
+        """
+        Seeds the generator of the initial states of all aircraft. Returns the list holding the seed used (the drawn
+        entropy if seed is None).
+        """
+        seedSequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(seedSequence)
+        return [seedSequence.entropy]
+
+    def _get_observations(self):
+        state = self.state
+        if self.task == 'glideAngle':
+            tas = state[:, flightModel.V]
+            Vh_ind = tas * np.sin(state[:, flightModel.GAMMA])
+            obs = glide_angle_observations(state[:, flightModel.Q], self.yoke, tas, Vh_ind,
+                                           self.targetGlideAngle).astype(np.float32)
+        else:
+            obs = np.zeros((self.num_envs, 8), dtype=np.float32)
+            alpha = state[:, flightModel.THETA] - state[:, flightModel.GAMMA]
+            obs[:, 0] = flightModel.indicatedAirspeed(state[:, flightModel.V], state[:, flightModel.H])
+            obs[:, 1] = alpha >= flightModel.ALPHA_STALL_WARNING
+            obs[:, 2] = state[:, flightModel.H] * FEET_PER_METER
+            obs[:, 3] = np.rad2deg(alpha)
+            obs[:, 4] = np.rad2deg(state[:, flightModel.THETA])
+            obs[:, 5] = self.yoke
+            obs[:, 6] = np.rad2deg(self.phi)
+            #obs[:, 7]: yoke_roll_ratio stays 0 as the roll isn't controlled
+        return obs
+
+    def _get_rewards(self, obs):
+        if self.task == 'glideAngle':
+            return glide_angle_reward(obs[:, 3], obs[:, 2], obs[:, 4]).astype(np.float32)
+        return speed_reward(obs[:, 0], obs[:, 1]).astype(np.float32)
+
+    def reset(self):
+        """Resets all aircraft and returns the stacked initial observations."""
+        self._reset_envs(np.arange(self.num_envs))
+        return self._get_observations()
+
+    def step(self, actions):
+        """
+        Args
+        ----
+        actions: an array of shape (num_envs, 1) or (num_envs,) holding the yoke_pitch_ratio for every aircraft
+
+        Returns
+        -------
+        obs, rewards, dones, infos : see XplaneEEEVectorEnv.step()
+        """
+        self.yoke = np.clip(np.asarray(actions, dtype=np.float64).reshape(self.num_envs), -1.0, 1.0)
+        self.state = flightModel.integrate(self.state, self.yoke, self.stepTime)
+        self.elapsedSteps += 1
+        obs = self._get_observations()
+        rewards = self._get_rewards(obs)
+        dones = ((self.state[:, flightModel.H] <= 0) | (self.state[:, flightModel.V] <= 1.0)
+                 | ~np.all(np.isfinite(self.state), axis=1))
+        if self.maxEpisodeSteps is not None:
+            dones |= self.elapsedSteps >= self.maxEpisodeSteps
+        infos = [{} for _ in range(self.num_envs)]
+        doneIdx = np.flatnonzero(dones)
+        if len(doneIdx):
+            for i in doneIdx:
+                infos[i]['terminal_observation'] = obs[i].copy()
+            self._reset_envs(doneIdx)
+            obs[doneIdx] = self._get_observations()[doneIdx]
+        return obs, rewards, dones, infos
+
+    def step_async(self, actions):
+        """Only stores the actions; the integration runs in step_wait(). Provided for API compatibility."""
+        self.pendingActions = actions
+
+    def step_wait(self):
+        return self.step(self.pendingActions)
+
+    def render(self, mode='human'):
+        print(f'mean reward: {self._get_rewards(self._get_observations()).mean()}; aircraft: {self.num_envs}')
+
+    def close(self):
+        pass
@@ -1,12 +1,12 @@
-import gym
 from gym import spaces
 # from gym import utils
 # from gym.utils import seeding
 import numpy as np
 import datetime
 
-from gym_XPlaneEEE.utils.IpcClient import IpcClient
-from gym_XPlaneEEE.utils.dataCenter import DataCenter
+from gym_XPlaneEEE.envs.XplaneEEEBase_env import XplaneEEEBaseEnv, SOCKET_NAME, LOCKSTEP_FRAMES_PER_STEP, clamp
+from gym_XPlaneEEE.utils.dataCenter import SPEED_OBSERVATION_KEYS
+from gym_XPlaneEEE.utils.frameMonitor import FLAG
 from gym_XPlaneEEE.utils.xPlaneGymCalculations import prepareInitialPlaneState
 
 
@@ -14,22 +14,67 @@ import logging
 logger = logging.getLogger(__name__)
 
 MAX_EPISODE_LENGTH = 90    #end the episode after 90 seconds
-SOCKET_NAME = "/tmp/eee_AutoViewer"
 DESIRED_SPEED = 68  #the best glide for the Cessna is 68 KIAS
 PUNISHMENT_STALL = -1   #TODO compare with the speed punishment and scale accordingly
 
-def clamp(n, minn, maxn): return max(min(maxn, n), minn)
 def knots_in_ms(knots): return  knots * 0.51444444444
 def ms_in_knots(ms): return  ms / 0.51444444444
 
-class XplaneEEESpeedEnv(gym.Env):
-    metadata = {'render.modes': ['human']}
+def speed_deviation(ias_ms):
+    """the normalized square deviation from the desired speed; works on arrays as well"""
+    ias_ms_norm = ias_ms/knots_in_ms(DESIRED_SPEED)
+    return (ias_ms_norm - 1)**2
 
-    def __init__(self):
-        super(XplaneEEESpeedEnv, self).__init__()
-        self.dc = DataCenter.instance()
-        self.ipcClient = None
-        self.curr_episode = 0
+def speed_reward(ias_ms, stallWarning):
+    """see XplaneEEESpeedEnv._get_reward(); works on arrays as well"""
+    #TODO this calculation and the factor are still somewhat arbitrary
+    return -10*speed_deviation(ias_ms) + np.where(stallWarning != 0, PUNISHMENT_STALL, 0.0)
+
+class XplaneEEESpeedEnv(XplaneEEEBaseEnv):
+    def __init__(self, socketName=SOCKET_NAME, ipcClient=None, transport='thread',
+                 lockstep=False, framesPerStep=LOCKSTEP_FRAMES_PER_STEP, recorder=None,
+                 latencyStats=None, maxFrameAge=None, stalePolicy=FLAG, settleReset=False, initialStatePool=None):
+        """
+        Args
+        ----
+        :param socketName = SOCKET_NAME: the socket of the DubinsPilot instance to connect to.
+        Can be given as kwarg to gym.make() to run several simulators from one process.
+
+        :param ipcClient = None: an already connected and started IpcClient/AsyncIpcClient/ProcessIpcClient to use instead of
+        creating a new connection. The env then reads the plane state from the client's DataCenter and
+        leaves closing the connection to the caller.
+
+        :param transport = 'thread': 'thread' listens to DubinsPilot with the IpcClient thread,
+        'asyncio' uses an AsyncIpcClient on the event loop shared by all asyncio connections,
+        'process' reads the socket in a separate process with the ProcessIpcClient (no recording).
+
+        :param lockstep = False: drive the simulation by frames instead of wall clock. Every action asks the
+        simulator to advance framesPerStep frames and step() returns as soon as the matching PLANE_STATE arrives.
+        The info dict then holds 'simTime' and 'simFrame' of the observation.
+
+        :param framesPerStep = LOCKSTEP_FRAMES_PER_STEP: the simulator frames to advance per step in lockstep mode
+
+        :param recorder = None: a TelemetryRecorder recording every received state, every action, the initial
+        states set by reset() and the episode boundaries (opt-in); its stateKeys are decoded in addition
+
+        :param latencyStats = None: a LatencyStats timing the stages of every step (see getLatencyStatistics())
+
+        :param maxFrameAge = None: the age [s] from which on an observed frame is stale. The info dict of every
+        step holds 'frameSeq', 'frameAge', 'skippedFrames' and 'repeatedFrame' of the observed frame and
+        'staleFrame' if it is stale (see FrameMonitor and getFrameStatistics()).
+
+        :param stalePolicy = FLAG: FLAG ('flag') only marks stale frames, WAIT ('wait') waits for a fresh frame first
+
+        :param settleReset = False: reset() returns as soon as the plane has settled in the new initial state
+        (see SettleDetector) instead of after a fixed number of frames; ignored in lockstep mode
+
+        :param initialStatePool = None: an InitialStatePool to draw the initial states from instead of sampling
+        them in reset(); may be shared by several envs
+        """
+        super(XplaneEEESpeedEnv, self).__init__(SPEED_OBSERVATION_KEYS, socketName, ipcClient, transport, lockstep,
+                                                framesPerStep, recorder, latencyStats, maxFrameAge, stalePolicy,
+                                                settleReset, initialStatePool)
+        self.speedExtractor = self.dc.compileObservation(SPEED_OBSERVATION_KEYS)
         self.reward = -10
         # Define action and observation space
         #- yoke_pitch_ratio
@@ -45,66 +90,18 @@ class XplaneEEESpeedEnv(gym.Env):
         #- yoke_roll_ratio       #The deflection of the joystick axis controlling roll.
         self.observation_space = spaces.Box(low=np.array([0.0,   0.0,     0.0,  10.0, -30.0, -1.0, -90.0, -1.0]), 
                                            high=np.array([120.0, 1.0, 15000.0, +10.0, +30.0, +1.0, +90.0, +1.0]), dtype=np.float32)
-        try: 
-            self._establish_connection()
-        except Exception as inst:
-            print(type(inst))    # the exception instance
-            print(inst.args)     # arguments stored in .args
-            print(inst)          # __str__ allows args to be printed directly, but may be overridden in exception subclasses
-            raise inst           # re-raise the exception to higher instances TODO: is this a good idea
-
-    def __del__(self):
-        self.ipcClient.setContinueFlag(False)   #make the ipcListener stop
-
-    def _establish_connection(self):
-        #start a listener thread
-        self.ipcClient = IpcClient.instance()
-        self.ipcClient.connect(SOCKET_NAME)
-        self.ipcClient.daemon = True    #like seen on https://www.geeksforgeeks.org/python-different-ways-to-kill-a-thread/
-        self.ipcClient.start()
-
-    def step(self, action):
-        """
+        self._connect()
 
-        Parameters
-        ----------
-        action (float): is the value of the elevator in the ranges [-1:1] as continuous float 
-
-        Returns
-        -------
-        ob, reward, episode_over, info : tuple
-            ob (object) :
-                an environment-specific object representing your observation of
-                the environment.
-            reward (float) :
-                amount of reward achieved by the previous action. The scale
-                varies between environments, but the goal is always to increase
-                your total reward.
-            episode_over (bool) :
-                whether it's time to reset the environment again. Most (but not
-                all) tasks are divided up into well-defined episodes, and done
-                being True indicates the episode has terminated. (For example,
-                perhaps the pole tipped too far, or you lost your last life.)
-            info (dict) :
-                 diagnostic information useful for debugging. It can sometimes
-                 be useful for learning (for example, it might contain the raw
-                 probabilities behind the environment's last state change).
-                 However, official evaluations of your agent are not allowed to
-                 use this for learning.
+    def _get_Observations(self, snapshot=None):
+        """
+        Returns a new float32 array holding the raw values of SPEED_OBSERVATION_KEYS (see DataCenter.getSpeedObservation())
+        of the latest frame or the frame of snapshot.
         """
-        self._take_action(action)
-        self.speedObservation = self.dc.getSpeedObservation()
-        self.reward = self._get_reward()
-        episode_over = self._check_end_episode()    #TODO
-        return self.speedObservation, self.reward, episode_over, {}
-
-    def _take_action(self, action):
-        action = float(action)  # convert the np.array[float32] to a single float value
-        clamp(action, -1.0, +1.0)
-        # prepare the entire message to be sent out to the DubinsPilot socket
-        ctrlDict = {}
-        ctrlDict['yoke_pitch_ratio'] = action  #action is a numpy.array with a single element
-        self.ipcClient.socketSendData('SET_ELEVATOR', 1, ctrlDict)
+        return self.speedExtractor.extract(snapshot=snapshot)
+
+    def _step_reward(self, obs):
+        self.speedObservation = obs
+        return self._get_reward()
 
     def _check_end_episode(self):
         """
@@ -118,7 +115,10 @@ class XplaneEEESpeedEnv(gym.Env):
         true: when the episode is over
         false: when the episde continues
         """
-        if (datetime.datetime.now() - self.startOfEpisode).seconds >= MAX_EPISODE_LENGTH:
+        if self.lockstep:
+            if self.simTime - self.startOfEpisodeSimTime >= MAX_EPISODE_LENGTH:
+                return True
+        elif (datetime.datetime.now() - self.startOfEpisode).seconds >= MAX_EPISODE_LENGTH:
             return True
 
         return False    #TODO check for weird flight conditions
@@ -133,17 +133,37 @@ class XplaneEEESpeedEnv(gym.Env):
         self.curr_step = -1
         self.curr_episode += 1
         self.startOfEpisode = datetime.datetime.now()
+        if self.recorder is not None:
+            self.recorder.recordEpisodeStart(self.curr_episode)
         # calculate new initial plane state
-        newPlaneState = prepareInitialPlaneState()
-        # set initial plane state
+        newPlaneState = self.initialStatePool.draw() if self.initialStatePool is not None else \
+            prepareInitialPlaneState(rng=self.rng)
+        # set initial plane state; count the frames from here on
+        resetSeq = self.dc.frameSeq
         if self.ipcClient.socketSendData("SET_PLANE_STATE", 1, newPlaneState['data']):
+            if self.recorder is not None:
+                self.recorder.recordPlaneState(newPlaneState['data'])
+            if self.lockstep:
+                #the simulation doesn't move on its own; advance it to get the first observation of the new state
+                self._take_action(0.0)
+                if not self._await_lockstep_ack():
+                    return None #timeout ocurred
+                self.startOfEpisodeSimTime = self.simTime
+                self.frameMonitor.restart(self.dc)
+                return self._get_Observations()
+            if self.settleDetector is not None:
+                #done as soon as the new state is there, but never waiting longer than without settle detection
+                if self.settleDetector.waitUntilSettled(newPlaneState['data'], resetSeq, 2) is None:
+                    return None #timeout ocurred
+                self.frameMonitor.restart(self.dc)
+                return self._get_Observations()
             #get the first observation after changing the plane's state
             print("Waiting for first two observations after RESET")
-            if not self.dc.awaitNextObservation():  #block until a new observation is sent from XPlane
+            #wait for two frames to be sure, there is no in between state captured
+            if not self.dc.waitForNFrames(2, since=resetSeq):
                 return None #timeout ocurred
-            if not self.dc.awaitNextObservation():  #Do this twice to be sure, there is no in between state captured
-                return None #timeout ocurred
-            return self.dc.getSpeedObservation()
+            self.frameMonitor.restart(self.dc)
+            return self._get_Observations()
         else:
             return None
 
@@ -153,17 +173,11 @@ class XplaneEEESpeedEnv(gym.Env):
         """
         print(f'indicated Airspeed: {ms_in_knots(self.speedObservation[0])}; target Airspeed: {DESIRED_SPEED}; reward: {self.reward};')
     
-    def _seed(self):
-        pass
-
     def _calculate_speed_deviation(self, ias_ms):
         """
         calculates the mean square deviation of the current state from the desired speed
         """
-        #normalize
-        ias_ms_norm = ias_ms/knots_in_ms(DESIRED_SPEED)
-        mse = (ias_ms_norm - 1)**2
-        return mse
+        return speed_deviation(ias_ms)
     
     def _caclulate_actuation_smoothness(self):
         #TODO calculate the smoothness over the last n elevator actions and weigh them with a suitable factor
@@ -179,8 +193,6 @@ class XplaneEEESpeedEnv(gym.Env):
           #TODO - for the smoothness of the actuation
         """
         #calculate deviation from the desired speed. Desired speed is normalized to 1.
-        reward = -10*self._calculate_speed_deviation(self.speedObservation[0])  #TODO this calculation and the factor are still somewhat arbitrary
-        if self.speedObservation[1] != 0:
-            reward += PUNISHMENT_STALL
+        reward = float(speed_reward(self.speedObservation[0], self.speedObservation[1]))
         reward += self._caclulate_actuation_smoothness()
         return reward
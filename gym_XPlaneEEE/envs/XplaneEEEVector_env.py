@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+import gym
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+class XplaneEEEVectorEnv(object):
+    """
+    Steps a batch of XPlane environments in parallel, each of them bound to its own DubinsPilot instance.
+
+    The sub-environments are stepped and reset concurrently from a thread pool, so the real-time waits
+    (e. g. in TimedActions or while waiting for the first observations after a reset) overlap instead of
+    adding up. Sub-environments whose episode is over are reset automatically; the last observation of the
+    finished episode is handed out as info['terminal_observation'].
+
+    Args
+    ----
+    :param env_fns: a list of callables, each creating one (wrapped) sub-environment
+    """
+    def __init__(self, env_fns):
+        self.envs = [env_fn() for env_fn in env_fns]
+        self.num_envs = len(self.envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.executor = ThreadPoolExecutor(max_workers=self.num_envs)
+        self.pendingSteps = []
+
+    def _as_observation(self, obs):
+        #the XPlane envs return None when the reset timed out; keep the batch rectangular nevertheless
+        if obs is None:
+            logger.warning("Sub-environment returned no observation. Using zeros instead.")
+            return np.zeros(self.observation_space.shape, dtype=self.observation_space.dtype)
+        return obs
+
+    def reset(self):
+        """Resets all sub-environments at once and returns the stacked initial observations."""
+        observations = list(self.executor.map(lambda env: env.reset(), self.envs))
+        return np.stack([self._as_observation(obs) for obs in observations]).astype(self.observation_space.dtype)
+
+    def _step_env(self, env, action):
+        obs, reward, done, info = env.step(action)
+        if done:
+            info = dict(info)
+            info['terminal_observation'] = obs
+            obs = env.reset()
+        return self._as_observation(obs), reward, done, info
+
+    def step(self, actions):
+        """
+        Args
+        ----
+        actions: an array of shape (num_envs, *action_space.shape) holding one action per sub-environment
+
+        Returns
+        -------
+        obs, rewards, dones, infos : stacked observations, an array of rewards, an array of done flags
+        and a list holding the info dictionary of every sub-environment
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions):
+        """Starts stepping all sub-environments in the background. Collect the results with step_wait()."""
+        self.pendingSteps = [self.executor.submit(self._step_env, env, action)
+                             for env, action in zip(self.envs, actions)]
+
+    def step_wait(self):
+        """Blocks until all sub-environments finished the steps started by step_async(); returns like step()."""
+        results = [future.result() for future in self.pendingSteps]
+        self.pendingSteps = []
+        observations, rewards, dones, infos = zip(*results)
+        return (np.stack(observations).astype(self.observation_space.dtype),
+                np.array(rewards, dtype=np.float32),
+                np.array(dones, dtype=np.bool_),
+                list(infos))
+
+    def seed(self, seed=None):
+        """Seeds every sub-environment with its own seed derived from seed. Returns the list of their seeds."""
+        seeds = np.random.SeedSequence(seed).generate_state(self.num_envs).tolist()
+        for env, envSeed in zip(self.envs, seeds):
+            env.seed(envSeed)
+        return seeds
+
+    def render(self, mode='human'):
+        for env in self.envs:
+            env.render(mode=mode)
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+        self.executor.shutdown(wait=False)
+
+def makeXPlaneVectorEnv(envId, socketNames, wrap=None, **kwargs):
+    """
+    Creates a XplaneEEEVectorEnv with one sub-environment of the registered envId per DubinsPilot socket.
+
+    Args
+    ----
+    :param envId: the id of the registered environment, e. g. 'XPlaneEEEGlideAngle-v0'
+
+    :param socketNames: a list of sockets, one for each DubinsPilot instance
+
+    :param wrap = None: a callable wrapping every sub-environment (e. g. to add TimeLimit and TimedActions)
+
+    :param kwargs: further kwargs passed to gym.make()
+    """
+    def make_env(socketName):
+        def _thunk():
+            env = gym.make(envId, socketName=socketName, **kwargs)
+            return wrap(env) if wrap is not None else env
+        return _thunk
+    return XplaneEEEVectorEnv([make_env(socketName) for socketName in socketNames])
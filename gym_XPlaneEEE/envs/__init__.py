@@ -1,2 +1,6 @@
 from gym_XPlaneEEE.envs.XplaneEEESpeed_env import XplaneEEESpeedEnv
 from gym_XPlaneEEE.envs.XplaneEEEGlideAngle_env import XplaneEEEGlideAngleEnv
+from gym_XPlaneEEE.envs.XplaneEEEGlideAngleSim_env import XplaneEEEGlideAngleSimEnv
+from gym_XPlaneEEE.envs.XplaneEEEVector_env import XplaneEEEVectorEnv, makeXPlaneVectorEnv
+from gym_XPlaneEEE.envs.XplaneEEESimVector_env import XplaneEEESimVectorEnv
+from gym_XPlaneEEE.envs.XplaneEEEGlideAngleReplay_env import XplaneEEEGlideAngleReplayEnv, replayObservationsAndRewards
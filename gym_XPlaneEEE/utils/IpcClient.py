@@ -9,6 +9,8 @@ from threading import Thread
 import threading 
 import ctypes 
 from gym_XPlaneEEE.utils.dataCenter import DataCenter
+from gym_XPlaneEEE.utils.frameDecoder import FrameDecoder
+from gym_XPlaneEEE.utils.latencyStats import DECODE
 from gym_XPlaneEEE.utils.singleton import SingletonMixin
 
 
@@ -16,25 +18,41 @@ from gym_XPlaneEEE.utils.singleton import SingletonMixin
 from gym_XPlaneEEE.utils.xPlaneGymCalculations import prepareInitialPlaneState
 printFlag = 0
 
+RECV_BUFFER_SIZE = 65536    #big enough to fetch a whole batch of coalesced PLANE_STATE messages at once
+
 class IpcClient(Thread, SingletonMixin):
-    def __init__ (self):
+    """
+    Listener thread for a single DubinsPilot connection. Received PLANE_STATEs are put into the given DataCenter.
+
+    Create one IpcClient (and one DataCenter) per connection. As every thread, an IpcClient can only be started
+    once; create a new one to reconnect. IpcClient.instance() is kept as the process wide default client.
+
+    Args
+    ----
+    :param dataCenter = None: the DataCenter to feed; the process wide DataCenter.instance() if None is given
+    """
+    def __init__ (self, dataCenter=None):
         Thread.__init__(self)
         self.continueFlag = True
-        self.dc = DataCenter.instance()
+        self.dc = dataCenter if dataCenter is not None else DataCenter.instance()
         self.client = None
         self.socketName = None
+        self.decoder = FrameDecoder()
+        self.recorder = None
+        self.latencyStats = None
     
     def connect(self, socketName):
         #close an existing connection
         if self.client:
             try:
-                self.client.close
+                self.client.close()
             except Exception as inst:
                 print(type(inst))    # the exception instance
                 print(inst.args)     # arguments stored in .args
                 print(inst)          # __str__ allows args to be printed directly, but may be overridden in exception subclasses
             self.client = None
         self.socketName = socketName
+        self.decoder.reset()    #don't glue the tail of an old connection to the new stream
         print ("Connecting...")
         if os.path.exists(self.socketName):
             self.client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -62,33 +80,35 @@ class IpcClient(Thread, SingletonMixin):
         while True:
             if not self.continueFlag:
                 break
-            datagram = self.client.recv( 2048 )
+            datagram = self.client.recv(RECV_BUFFER_SIZE)
             if not datagram:
                 break
-            else:
-                # print ("-" * 20)
-                # print (datagram)
+            droppedBefore = self.decoder.droppedFrames
+            decodingStart = time.perf_counter()
+            frames = self.decoder.feed(datagram)
+            if self.latencyStats is not None:
+                self.latencyStats.record(DECODE, time.perf_counter() - decodingStart)
+            for socketData in frames:
                 try:
-                    socketData = json.loads(datagram[:-1])  #there is an extra `\f` character at the end of the data; see SockServer.cpp
                     if(socketData['type'] == 'PLANE_STATE'):
                         if printFlag>0:
                             print (json.dumps(socketData, sort_keys=True, indent=4))
                             printFlag -= 1
-                        # print("PLANE_STATE received")
                         self.dc.putState(socketData['data'])
+                        if self.recorder is not None:
+                            self.recorder.recordState(socketData['data'])
                     else:
                         print (json.dumps(socketData, sort_keys=True, indent=4))
-                except ValueError as inst:
-                    print(type(inst))    # the exception instance
-                    print(inst.args)     # arguments stored in .args
-                    print(inst)          # __str__ allows args to be printed directly, but may be overridden in exception subclasses
                 except Exception as inst:
                     print(type(inst))    # the exception instance
                     print(inst.args)     # arguments stored in .args
                     print(inst)          # __str__ allows args to be printed directly, but may be overridden in exception subclasses
+            if self.decoder.droppedFrames != droppedBefore:
+                print("Dropped {} corrupt or partial frames so far.".format(self.decoder.droppedFrames))
         print ("Lost Connection!")
         try:
-            self.client.close
+            if self.client:
+                self.client.close()
         except Exception as inst:
             print(type(inst))    # the exception instance
             print(inst.args)     # arguments stored in .args
@@ -96,9 +116,38 @@ class IpcClient(Thread, SingletonMixin):
         self.client = None
         print ("Done. Quitting IPC-Client Thread now.")
     
+    def setStateDecoder(self, stateDecoder):
+        """
+        Replaces the full JSON parsing of PLANE_STATE messages by the given PlaneStateDecoder.
+        The DataCenter is switched to the decoder's record layout accordingly.
+        """
+        self.dc.setStateSchema(stateDecoder)
+        self.decoder.decode = stateDecoder
+        if self.recorder is not None:
+            self.recorder.setStateSchema(stateDecoder)
+
+    def setRecorder(self, recorder):
+        """Records every received PLANE_STATE with the given TelemetryRecorder; None to stop recording."""
+        if recorder is not None:
+            recorder.setStateSchema(self.dc.stateSchema)
+        self.recorder = recorder
+
+    def setLatencyStats(self, latencyStats):
+        """Times the decoding of every received datagram with the given LatencyStats; None to stop timing."""
+        self.latencyStats = latencyStats
+
+    def getDecoderStatistics(self):
+        """Returns the number of decoded and dropped frames of the current connection."""
+        return self.decoder.getStatistics()
+
     def setContinueFlag(self, flag):
         self.continueFlag = True if flag == True else False
         print("continueFlag = %r" % self.continueFlag)
+        if not self.continueFlag and self.client:
+            try:
+                self.client.shutdown(socket.SHUT_RDWR)  #wake up the blocking recv() so the thread can end
+            except OSError:
+                pass    #not connected any more
     
     def socketSendData(self, msgTypeStr, requestId, dataDict):
         if self.client == None:
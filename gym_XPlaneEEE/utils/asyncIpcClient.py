@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os.path
+import threading
+import time
+from gym_XPlaneEEE.utils.dataCenter import DataCenter
+from gym_XPlaneEEE.utils.frameDecoder import FrameDecoder
+from gym_XPlaneEEE.utils.latencyStats import DECODE
+
+RECV_BUFFER_SIZE = 65536
+SEND_TIMEOUT = 1.0  #seconds to wait for a blocking send issued from outside the event loop
+
+_sharedLoop = None
+_sharedLoopLock = threading.Lock()
+
+def getSharedEventLoop():
+    """
+    Returns the event loop that drives all AsyncIpcClients used through their blocking interface.
+    The loop runs in a single daemon thread, no matter how many connections are open.
+    """
+    global _sharedLoop
+    with _sharedLoopLock:
+        if _sharedLoop is None:
+            _sharedLoop = asyncio.new_event_loop()
+            loopThread = threading.Thread(target=_sharedLoop.run_forever, name='AsyncIpcClientLoop')
+            loopThread.daemon = True
+            loopThread.start()
+    return _sharedLoop
+
+class AsyncIpcClient(object):
+    """
+    asyncio based alternative to the thread based IpcClient for the DubinsPilot socket.
+
+    Used from within a coroutine, the client offers the awaitable methods open(), send(), listen() and close()
+    and can be iterated asynchronously to get the data of every decoded PLANE_STATE frame:
+
+        client = AsyncIpcClient()
+        await client.open("/tmp/eee_AutoViewer")
+        async for planeState in client:
+            await client.send('SET_ELEVATOR', 1, {'yoke_pitch_ratio': 0.0})
+
+    For the (synchronous) gym environments it also provides the blocking interface of the IpcClient
+    (connect(), start(), socketSendData(), setContinueFlag()). These run the coroutines on a shared event loop,
+    so that several connections don't need a listener thread each.
+    """
+    def __init__(self, dataCenter=None):
+        self.dc = dataCenter if dataCenter is not None else DataCenter.instance()
+        self.decoder = FrameDecoder()
+        self.recorder = None
+        self.latencyStats = None
+        self.socketName = None
+        self.reader = None
+        self.writer = None
+        self.listenTask = None
+        self.loop = None
+        self.daemon = True  #only for compatibility with the IpcClient thread interface
+
+    async def open(self, socketName):
+        """Opens the connection to the DubinsPilot socket."""
+        if self.writer is not None:
+            await self.close()
+        if not os.path.exists(socketName):
+            raise ConnectionError(socketName, " does not exist. Quitting!")
+        self.socketName = socketName
+        self.decoder.reset()
+        print("Connecting...")
+        try:
+            self.reader, self.writer = await asyncio.open_unix_connection(socketName)
+        except OSError:
+            raise ConnectionError("couldn't connect to ", socketName, ". Quitting!")
+        self.loop = asyncio.get_running_loop()
+
+    async def send(self, msgTypeStr, requestId, dataDict):
+        """Sends a message to DubinsPilot. Returns False if there is no connection."""
+        if self.writer is None:
+            print("No connection available. Try again later.")
+            return False
+        j = {}
+        j['type']      = msgTypeStr
+        j['requestId'] = requestId
+        j['data']      = dataDict
+        try:
+            self.writer.write(json.dumps(j).encode('utf-8'))
+            await self.writer.drain()
+        except Exception as inst:
+            print(type(inst))    # the exception instance
+            print(inst.args)     # arguments stored in .args
+            print(inst)
+            return False
+        return True
+
+    def __aiter__(self):
+        return self.frames()
+
+    async def frames(self):
+        """Asynchronously yields the data of every PLANE_STATE frame received until the connection is closed."""
+        while self.reader is not None:
+            datagram = await self.reader.read(RECV_BUFFER_SIZE)
+            if not datagram:
+                break
+            decodingStart = time.perf_counter()
+            frames = self.decoder.feed(datagram)
+            if self.latencyStats is not None:
+                self.latencyStats.record(DECODE, time.perf_counter() - decodingStart)
+            for socketData in frames:
+                try:
+                    if socketData['type'] != 'PLANE_STATE':
+                        print(json.dumps(socketData, sort_keys=True, indent=4))
+                        continue
+                    planeState = socketData['data']
+                except Exception as inst:
+                    print(type(inst))    # the exception instance
+                    print(inst.args)     # arguments stored in .args
+                    print(inst)
+                    continue    #skip the malformed frame, keep listening
+                yield planeState
+
+    async def listen(self):
+        """Puts every received PLANE_STATE into the DataCenter until the connection is lost."""
+        print("Ready.")
+        try:
+            async for planeState in self.frames():
+                try:
+                    self.dc.putState(planeState)
+                    if self.recorder is not None:
+                        self.recorder.recordState(planeState)
+                except Exception as inst:
+                    print(type(inst))    # the exception instance
+                    print(inst.args)     # arguments stored in .args
+                    print(inst)
+        except (ConnectionError, asyncio.IncompleteReadError) as inst:
+            print(inst)
+        print("Lost Connection!")
+
+    async def close(self):
+        """Closes the connection and stops listening."""
+        if self.listenTask is not None and self.listenTask is not asyncio.current_task():
+            self.listenTask.cancel()
+        self.listenTask = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass    #the connection is gone anyway
+        self.reader = None
+        self.writer = None
+
+    def setStateDecoder(self, stateDecoder):
+        """see IpcClient.setStateDecoder()"""
+        self.dc.setStateSchema(stateDecoder)
+        self.decoder.decode = stateDecoder
+        if self.recorder is not None:
+            self.recorder.setStateSchema(stateDecoder)
+
+    def setRecorder(self, recorder):
+        """Records every received PLANE_STATE with the given TelemetryRecorder; None to stop recording."""
+        if recorder is not None:
+            recorder.setStateSchema(self.dc.stateSchema)
+        self.recorder = recorder
+
+    def setLatencyStats(self, latencyStats):
+        """see IpcClient.setLatencyStats()"""
+        self.latencyStats = latencyStats
+
+    def getDecoderStatistics(self):
+        return self.decoder.getStatistics()
+
+    def getSocketName(self):
+        return self.socketName
+
+    # blocking interface of the IpcClient, running the coroutines on the shared event loop
+    def _runBlocking(self, coro, timeout=None):
+        loop = self.loop if self.loop is not None else getSharedEventLoop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def connect(self, socketName):
+        self._runBlocking(self.open(socketName))
+
+    def start(self):
+        """Starts listening for PLANE_STATEs in the background on the event loop of the connection."""
+        if not self.socketName:
+            raise ConnectionError("No socketName set to connect to. Use connect(sn) before starting the listener.")
+        async def _startListening():
+            self.listenTask = asyncio.ensure_future(self.listen())
+        self._runBlocking(_startListening())
+
+    def socketSendData(self, msgTypeStr, requestId, dataDict):
+        try:
+            return self._runBlocking(self.send(msgTypeStr, requestId, dataDict), SEND_TIMEOUT)
+        except Exception as inst:
+            print(type(inst))
+            print(inst)
+            return False
+
+    def setContinueFlag(self, flag):
+        if not flag and self.loop is not None and not self.loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.close(), self.loop)
+        print("continueFlag = %r" % bool(flag))
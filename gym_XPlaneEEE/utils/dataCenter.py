@@ -1,28 +1,193 @@
-from threading import Lock, Event
+from threading import Condition
+import time
 from gym_XPlaneEEE.utils.singleton import SingletonMixin
+from gym_XPlaneEEE.utils.planeStateDecoder import normalizeKeyPath
+from gym_XPlaneEEE.utils.stateHistory import StateHistory, HISTORY_CAPACITY
+from gym_XPlaneEEE.utils.derivedFeatures import DerivedFeatures, GLIDE_ANGLE_DEVIATION, glideAngleDeviation
 import numpy as np
 
-planeStateLock = Lock()
-newDataEvent = Event()
+# the raw state values needed by the observations of the speed and glide angle tasks
+SPEED_OBSERVATION_KEYS = ['indicated_airspeed_ms', 'stallWarning', 'h_ind', 'alpha',
+                          'true_theta', 'yoke_pitch_ratio', 'true_phi', 'yoke_roll_ratio']
+GLIDE_ANGLE_STATE_KEYS = ['Qrad', 'yoke_pitch_ratio', 'true_airspeed', 'vh_ind',
+                          ['targetValues','requestedClimbRate']]
+# the tags of a PLANE_STATE answering a lockstep request (see MockDubinsPilot)
+LOCKSTEP_KEYS = ['simTime', 'simFrame', 'ackRequestId']
+FRAME_TIMEOUT = 1.0 #seconds to wait for the next PLANE_STATE before giving up
+
+class ObservationExtractor(object):
+    """
+    A key list as used by DataCenter.getObservation(), compiled once for fast repeated extraction.
+
+    The key list may hold None placeholders and nested keys. The placeholders are left untouched in the output
+    buffer, so derived values can be filled in by the caller. For the float64 records of a PlaneStateDecoder the
+    extraction is a single fancy indexing operation; the column indices are compiled on first use of a schema.
+
+    Args
+    ----
+    :param dataCenter: the DataCenter to read from
+
+    :param keyList: the keys to extract (see DataCenter.getObservation())
+    """
+    def __init__(self, dataCenter, keyList):
+        self.dc = dataCenter
+        self.size = len(keyList)
+        self.destIdx = np.array([idx for idx, key in enumerate(keyList) if key is not None], dtype=np.intp)
+        self.keyPaths = [normalizeKeyPath(key) for key in keyList if key is not None]
+        self.destPaths = list(zip(self.destIdx.tolist(), self.keyPaths))
+        self.schema = None
+        self.srcIdx = None
+
+    def _compile(self, schema):
+        self.srcIdx = np.array([schema.indexOf(keyPath) for keyPath in self.keyPaths], dtype=np.intp)
+        self.schema = schema
+
+    def extract(self, out=None, snapshot=None):
+        """
+        Fills the values of the keys into out (a new float32 array if None) and returns it.
+        Reads from the given snapshot (see DataCenter.getSnapshot()) or the latest frame. Without any state
+        received yet, the values are set to zero.
+        """
+        if out is None:
+            out = np.zeros(self.size, dtype=np.float32)
+        _, planeState, stateSchema, _ = snapshot if snapshot is not None else self.dc.snapshot
+        if planeState is None:
+            out[self.destIdx] = 0
+        elif stateSchema is not None:
+            if stateSchema is not self.schema:
+                self._compile(stateSchema)
+            out[self.destIdx] = planeState[self.srcIdx]
+        else:
+            for idx, keyPath in self.destPaths:
+                retrievedItem = planeState
+                for subKey in keyPath:
+                    retrievedItem = retrievedItem[subKey]
+                out[idx] = retrievedItem
+        return out
 
 class DataCenter(SingletonMixin):
+    """
+    Stores the latest plane state received from one DubinsPilot connection.
+
+    The states are published as snapshots (sequence number, plane state, state schema, receive timestamp).
+    The listener replaces
+    the whole snapshot with a single reference assignment and never modifies a published plane state, so a reader
+    gets all values of one and the same frame by fetching the snapshot once (see getSnapshot()), without locking.
+
+    Every frame gets the next number of a monotonically increasing sequence (see frameSeq). Threads waiting for
+    frames (see waitForFrame() and waitForNFrames()) are woken by a condition variable as soon as their frame is
+    published, so no frame is missed and none is counted twice.
+
+    Every connection needs its own DataCenter. DataCenter.instance() is kept as the process wide default
+    for code that only ever talks to a single DubinsPilot.
+    """
     def __init__ (self):
-        self.planeState = None
+        self.frameCondition = Condition()
         self.observation = 0
+        self.snapshot = (0, None, None, None)
+        self.history = None
+        self.historyExtractor = None
+        self.historyRow = None
+        self.derivedFeatures = DerivedFeatures(self)
+        self.derivedFeatures.register(GLIDE_ANGLE_DEVIATION, ['true_airspeed', 'vh_ind',
+                                      ['targetValues','requestedClimbRate']], glideAngleDeviation)
+
+    @property
+    def planeState(self):
+        return self.snapshot[1]
+
+    @property
+    def frameSeq(self):
+        """The sequence number of the latest frame; 0 before the first frame."""
+        return self.snapshot[0]
 
-    def putState(self, planeState):
-        planeStateLock.acquire()
-        self.planeState = planeState
-        planeStateLock.release()
+    @property
+    def stateSchema(self):
+        return self.snapshot[2]
+
+    @property
+    def frameTimestamp(self):
+        """The time.monotonic() of receipt of the latest frame; None before the first frame."""
+        return self.snapshot[3]
+
+    def setStateSchema(self, stateSchema):
+        """
+        Announces that the states put into the DataCenter are float64 records as produced by a PlaneStateDecoder
+        instead of the full nested dictionaries. stateSchema is used to look up the column of each key.
+        Pass None to switch back to dictionaries.
+        """
+        #a state of the old format can't be interpreted any more
+        self.snapshot = (self.observation, None, stateSchema, self.snapshot[3])
+
+    def enableHistory(self, keyList, capacity=HISTORY_CAPACITY):
+        """
+        Keeps the values of keyList of the last capacity frames, with their receive timestamps and sequence numbers.
+        With a state schema set, all keys of keyList must be decoded (see the stateKeys of the envs); otherwise a
+        KeyError is raised.
+
+        Returns
+        -------
+        The StateHistory (also available as DataCenter.history) to query the frames.
+        """
+        stateSchema = self.stateSchema
+        if stateSchema is not None:
+            missing = [key for key in keyList if normalizeKeyPath(key) not in stateSchema.index]
+            if missing:
+                raise KeyError("The history keys {} aren't decoded; the decoder only provides {}".format(
+                    missing, stateSchema.keyPaths))
+        self.historyExtractor = self.compileObservation(keyList)
+        self.historyRow = np.zeros(len(keyList))
+        self.history = StateHistory(keyList, capacity)
+        return self.history
+
+    def putState(self, planeState, timestamp=None):
+        """
+        Publishes a new plane state. The plane state must not be modified afterwards.
+        timestamp is the time.monotonic() of receipt; defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
         self.observation += 1
-        newDataEvent.set()
+        snapshot = (self.observation, planeState, self.snapshot[2], timestamp)
+        if self.history is not None:
+            try:
+                self.history.append(timestamp, self.observation,
+                                    self.historyExtractor.extract(self.historyRow, snapshot))
+            except (KeyError, IndexError) as inst:
+                print("Couldn't append the frame to the history:", inst)    #publish it nevertheless
+        self.snapshot = snapshot
+        with self.frameCondition:
+            self.frameCondition.notify_all()
+
+    def getSnapshot(self):
+        """
+        Returns
+        -------
+        The consistent snapshot (sequence number, plane state, state schema, receive timestamp) of the latest
+        frame. Pass it to getObservation(), getDerived() and frameAge() to read several values of the same frame.
+        """
+        return self.snapshot
+
+    def frameAge(self, now=None, snapshot=None):
+        """
+        The seconds since the latest frame (or the frame of snapshot) was received; None before the first frame.
+        now defaults to time.monotonic().
+        """
+        frameTimestamp = (snapshot if snapshot is not None else self.snapshot)[3]
+        if frameTimestamp is None:
+            return None
+        return (time.monotonic() if now is None else now) - frameTimestamp
+
+    def getDerived(self, name, snapshot=None):
+        """Returns the derived feature name of the latest frame or snapshot (see DerivedFeatures.get())."""
+        return self.derivedFeatures.get(name, snapshot)
+
+    def compileObservation(self, keyList):
+        """Returns an ObservationExtractor reading the keys of keyList (see getObservation()) from this DataCenter."""
+        return ObservationExtractor(self, keyList)
 
     def getState(self):
-        newDataEvent.clear()
-        planeStateLock.acquire()
-        currentState = self.planeState
-        planeStateLock.release()
-        return currentState
+        return self.snapshot[1]
     
     def getSpeedObservation(self):
         """
@@ -40,23 +205,7 @@ class DataCenter(SingletonMixin):
 
         Normalization of the values needs to be done in a wrapper.
         """
-        obs = np.zeros(8)
-        planeStateLock.acquire()
-        if self.planeState == None:
-            #it may happen, that there is no observation available yet
-            planeStateLock.release()
-            return obs
-        obs[0] = self.planeState['indicated_airspeed_ms']
-        obs[1] = self.planeState['stallWarning']
-        obs[2] = self.planeState['h_ind']
-        obs[3] = self.planeState['alpha']
-        obs[4] = self.planeState['true_theta']
-        obs[5] = self.planeState['yoke_pitch_ratio']
-        obs[6] = self.planeState['true_phi']
-        obs[7] = self.planeState['yoke_roll_ratio']
-        planeStateLock.release()
-
-        return obs
+        return self.getObservation(SPEED_OBSERVATION_KEYS)
 
     def getGlideAngleObservation(self):
         """
@@ -78,25 +227,15 @@ class DataCenter(SingletonMixin):
         """
         # keyList = [None, 'stallWarning', 'true_airspeed', 'vh_ind', 'h_ind', 
         #            'alpha', 'true_theta', 'yoke_pitch_ratio', 'true_phi', 'yoke_roll_ratio']
+        snapshot = self.getSnapshot()  #take all values from the same frame
         keyList = [None, None, 'Qrad']
-        obs = self.getObservation(keyList)
-        tas, Vh_ind = self.getObservation(['true_airspeed','vh_ind'])
-        # if obs[2] != 0:
-        #     #wir müssen den Gleitwinkel selber rechnen aus true_airspeed und sinkrate
-        #     #der von XPlane ausgegebene Winkel ist bezogen auf ground_speed und damit bei Wind unbrauchbar.
-        #     obs[0] = np.rad2deg(np.arctan(obs[3]/obs[2]))
-        glideAngleRad = 0.0
-        if tas != 0:
-            #wir müssen den Gleitwinkel selber rechnen aus true_airspeed und sinkrate
-            #der von XPlane ausgegebene Winkel ist bezogen auf ground_speed und damit bei Wind unbrauchbar.
-            glideAngleRad = np.arctan(Vh_ind/tas)  #in radians
-        targetGlideAngle = np.deg2rad(self.getObservation([['targetValues','requestedClimbRate']])[0])
-        angleDeviation = glideAngleRad - targetGlideAngle
+        obs = self.getObservation(keyList, snapshot)
+        angleDeviation = self.getDerived(GLIDE_ANGLE_DEVIATION, snapshot)
         obs[0] = np.sin(angleDeviation)
         obs[1] = np.cos(angleDeviation)
         return obs
 
-    def getObservation(self, keyList):
+    def getObservation(self, keyList, snapshot=None):
         """
         Args
         ------
@@ -105,6 +244,8 @@ class DataCenter(SingletonMixin):
 
         When accessing nested keys, use a list of subsequent subkeys at the desired position. (e. g. targetValueKeys = [['targetValues','requestedClimbRate'], ['targetValues','requestedRoll']])
 
+        Optionally a snapshot as returned by getSnapshot() to read from instead of the latest frame.
+
         Returns
         -------
         Returns a single (raw) observation in form of a Numpy array. The datarefs given in the input list are included in the given order.
@@ -112,28 +253,58 @@ class DataCenter(SingletonMixin):
         Derived values shall be calculated in the calling function. They are left as Zero values in the returned array.
         """
         obs = np.zeros(len(keyList))
-        planeStateLock.acquire()
-        if self.planeState == None:
+        _, planeState, stateSchema, _ = snapshot if snapshot is not None else self.snapshot
+        if planeState is None:
             #it may happen, that there is no observation available yet
-            planeStateLock.release()
+            return obs
+        if stateSchema is not None:
+            #the state is a flat record already; just pick the columns
+            for idx, key in enumerate(keyList):
+                if key is not None:
+                    obs[idx] = planeState[stateSchema.indexOf(key)]
             return obs
         for idx, key in enumerate(keyList):
             if key == None:
                 continue
             if not isinstance(key, list):
                 key = [key] #now we have a single element list
-            retrievedItem = self.planeState
+            retrievedItem = planeState
             for subKey in key:
                 retrievedItem = retrievedItem[subKey]
             obs[idx] = retrievedItem
-        planeStateLock.release()
         return obs
 
+    def waitForFrame(self, seq, timeout=FRAME_TIMEOUT):
+        """
+        Blocks until the frame with sequence number seq (or a later one) is published.
+        Returns False if this didn't happen within timeout seconds.
+        """
+        if self.snapshot[0] >= seq:
+            return True
+        with self.frameCondition:
+            return self.frameCondition.wait_for(lambda: self.snapshot[0] >= seq, timeout)
+
+    def waitForNFrames(self, n, since=None, timeout=None):
+        """
+        Blocks until n frames were published after the frame with sequence number since (default: the latest one).
+        Take since from frameSeq before sending a request to count only the frames following it.
+        timeout defaults to FRAME_TIMEOUT per frame. Returns False on timeout.
+        """
+        if since is None:
+            since = self.snapshot[0]
+        return self.waitForFrame(since + n, n * FRAME_TIMEOUT if timeout is None else timeout)
+
     def awaitNextObservation(self):
         """Blocks until a new observation is received"""
-        newDataEvent.clear()
-        newDataEvent.wait(1)    #1 second timeout
-        return newDataEvent.isSet()
+        return self.waitForNFrames(1)
 
-
-        
\ No newline at end of file
+    def awaitRequestAck(self, requestId, timeout=FRAME_TIMEOUT):
+        """
+        Blocks until a PLANE_STATE acknowledging the lockstep request requestId is received.
+        Returns False if this didn't happen within timeout seconds.
+        """
+        acknowledged = lambda: self.getObservation(['ackRequestId'])[0] == requestId
+        if acknowledged():
+            return True
+        with self.frameCondition:
+            return self.frameCondition.wait_for(acknowledged, timeout)
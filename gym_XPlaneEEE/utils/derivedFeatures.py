@@ -0,0 +1,70 @@
+import numpy as np
+
+# the names of the features every DataCenter provides
+GLIDE_ANGLE_DEVIATION = 'glideAngleDeviation'
+
+def glideAngleDeviation(tas, Vh_ind, requestedClimbRate):
+    """
+    The deviation [rad] of the glide angle from the requested one [deg]. Works on arrays as well.
+    """
+    #wir müssen den Gleitwinkel selber rechnen aus true_airspeed und sinkrate
+    #der von XPlane ausgegebene Winkel ist bezogen auf ground_speed und damit bei Wind unbrauchbar.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        glideAngleRad = np.where(tas != 0, np.arctan(Vh_ind/np.where(tas != 0, tas, 1.0)), 0.0)  #in radians
+    return glideAngleRad - np.deg2rad(requestedClimbRate)
+
+class _Feature(object):
+    def __init__(self, dataCenter, keyList, function):
+        self.extractor = dataCenter.compileObservation(keyList)
+        self.values = np.zeros(len(keyList))
+        self.function = function
+
+    def compute(self, snapshot):
+        value = self.function(*self.extractor.extract(self.values, snapshot))
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False   #the value is shared by all readers of the frame
+        return value
+
+class DerivedFeatures(object):
+    """
+    Registry of values derived from the plane state, computed at most once per frame.
+
+    A feature is a function of some raw state values (a key list as used by DataCenter.getObservation()).
+    It is computed when it is first requested for a frame and cached by the sequence number of that frame, so
+    the env, its reward and render() share a single computation. Features nobody asks for cost nothing.
+    Array values are returned read only; copy them before modifying.
+
+    Args
+    ----
+    :param dataCenter: the DataCenter to read the frames from
+    """
+    def __init__(self, dataCenter):
+        self.dc = dataCenter
+        self.features = {}
+        self.cache = (None, None, {})  #(frame seq, plane state, {name: value})
+
+    def register(self, name, keyList, function):
+        """
+        Registers function(*values of keyList) as the feature name. Registering a name again replaces the feature.
+        """
+        self.features[name] = _Feature(self.dc, keyList, function)
+        self.cache = (None, None, {})
+
+    def isRegistered(self, name):
+        return name in self.features
+
+    def get(self, name, snapshot=None):
+        """
+        Returns the value of the feature name for the given snapshot (see DataCenter.getSnapshot()) or the
+        latest frame.
+        """
+        if snapshot is None:
+            snapshot = self.dc.snapshot
+        seq, planeState, _, _ = snapshot
+        cachedSeq, cachedState, values = self.cache
+        if cachedSeq != seq or cachedState is not planeState:
+            values = {}
+            self.cache = (seq, planeState, values)
+        if name not in values:
+            values[name] = self.features[name].compute(snapshot)
+        return values[name]
@@ -0,0 +1,136 @@
+import collections
+from threading import Lock
+import numpy as np
+
+from gym_XPlaneEEE.utils.xPlaneGymCalculations import prepareInitialPlaneStates, eulerAnglesFromQuaternion
+
+# the state values telling whether the plane has settled in a requested state
+VELOCITY_KEYS = ['local_vx', 'local_vy', 'local_vz']
+ATTITUDE_KEYS = ['true_psi', 'true_theta', 'true_phi']
+RATE_KEYS = ['Prad', 'Qrad', 'Rrad']
+SETTLE_KEYS = ['h_ind'] + VELOCITY_KEYS + ATTITUDE_KEYS + RATE_KEYS
+FEET_PER_METER = 3.28084
+ALTITUDE_TOLERANCE = 100.0  #ft; local_y is only roughly the height above sea level
+VELOCITY_TOLERANCE = 1.0    #m/s per component of the velocity in local coordinates
+ANGLE_TOLERANCE = 2.0       #deg of heading, pitch and roll
+RATE_THRESHOLD = 0.05       #rad/s of roll, pitch and yaw rate
+POOL_SIZE = 1000
+
+def requestedState(dataRefs):
+    """
+    The altitude [ft], the velocity (local_vx, local_vy, local_vz) [m/s] and the attitude (psi, theta, phi) [deg]
+    requested by the dataRefs of a SET_PLANE_STATE message.
+    """
+    velocity = np.array([dataRefs['sim/flightmodel/position/' + key] for key in VELOCITY_KEYS])
+    attitude = np.array(eulerAnglesFromQuaternion([dataRefs['sim/flightmodel/position/q[%d]' % idx]
+                                                   for idx in range(4)]))
+    return dataRefs['sim/flightmodel/position/local_y'] * FEET_PER_METER, velocity, attitude
+
+class SettleDetector(object):
+    """
+    Tells when the plane has taken over the state requested by a SET_PLANE_STATE and settled: the altitude, every
+    velocity component and the heading, pitch and roll match the requested ones and the roll, pitch and yaw rates
+    are below a threshold. As the heading is drawn uniformly, a frame still showing the previous state hardly passes.
+
+    The DataCenter needs the SETTLE_KEYS to be decoded. The counters settledResets, unsettledResets and
+    waitedFrames sum up the results of waitUntilSettled().
+
+    Args
+    ----
+    :param dataCenter: the DataCenter receiving the frames
+
+    :param altitudeTolerance = ALTITUDE_TOLERANCE: ft
+
+    :param velocityTolerance = VELOCITY_TOLERANCE: m/s per component
+
+    :param angleTolerance = ANGLE_TOLERANCE: deg
+
+    :param rateThreshold = RATE_THRESHOLD: rad/s
+    """
+    def __init__(self, dataCenter, altitudeTolerance=ALTITUDE_TOLERANCE, velocityTolerance=VELOCITY_TOLERANCE,
+                 angleTolerance=ANGLE_TOLERANCE, rateThreshold=RATE_THRESHOLD):
+        self.dc = dataCenter
+        self.extractor = dataCenter.compileObservation(SETTLE_KEYS)
+        self.values = np.zeros(len(SETTLE_KEYS))
+        self.altitudeTolerance = altitudeTolerance
+        self.velocityTolerance = velocityTolerance
+        self.angleTolerance = angleTolerance
+        self.rateThreshold = rateThreshold
+        self.settledResets = 0
+        self.unsettledResets = 0
+        self.waitedFrames = 0
+
+    def isSettled(self, dataRefs, snapshot=None):
+        """Whether the latest frame (or snapshot) shows the state requested by dataRefs."""
+        altitude, velocity, attitude = requestedState(dataRefs)
+        values = self.extractor.extract(self.values, snapshot)
+        h_ind, velocityValues, attitudeValues, rates = values[0], values[1:4], values[4:7], values[7:10]
+        angleDeviation = (attitudeValues - attitude + 180) % 360 - 180  #the heading wraps around
+        return abs(h_ind - altitude) <= self.altitudeTolerance and \
+            np.all(np.abs(velocityValues - velocity) <= self.velocityTolerance) and \
+            np.all(np.abs(angleDeviation) <= self.angleTolerance) and np.all(np.abs(rates) <= self.rateThreshold)
+
+    def waitUntilSettled(self, dataRefs, since, maxFrames):
+        """
+        Blocks until a frame received after the frame with sequence number since shows the settled state requested
+        by dataRefs, but at most for maxFrames frames.
+
+        Returns
+        -------
+        True if the plane settled, False if it didn't within maxFrames frames, None if no frame arrived in time.
+        """
+        seq = since
+        while seq < since + maxFrames:
+            if not self.dc.waitForFrame(seq + 1):
+                return None
+            seq = self.dc.frameSeq
+            if self.isSettled(dataRefs):
+                self.settledResets += 1
+                self.waitedFrames += seq - since
+                return True
+        self.unsettledResets += 1
+        self.waitedFrames += maxFrames
+        return False
+
+class InitialStatePool(object):
+    """
+    Initial plane states (SET_PLANE_STATE messages) generated in advance, so reset() doesn't need to sample.
+    When the pool is used up, it is filled again. Drawing is thread safe, so several envs may share a pool.
+
+    Args
+    ----
+    :param size = POOL_SIZE: the number of states generated at once
+
+    :param generate = None: the function returning one initial state message; if None, the states are drawn by
+    prepareInitialPlaneStates() in one vectorized pass
+
+    :param rng = None: the np.random.Generator prepareInitialPlaneStates() draws from; the global np.random if None
+    """
+    def __init__(self, size=POOL_SIZE, generate=None, rng=None):
+        self.size = size
+        self.generate = generate
+        self.rng = rng
+        self.states = collections.deque()
+        self.lock = Lock()
+        self.fill()
+
+    def fill(self):
+        """Adds size new states to the pool."""
+        with self.lock:
+            self._fill()
+
+    def _fill(self):
+        if self.generate is not None:
+            self.states.extend(self.generate() for _ in range(self.size))
+        else:
+            self.states.extend(prepareInitialPlaneStates(self.size, self.rng))
+
+    def __len__(self):
+        return len(self.states)
+
+    def draw(self):
+        """Returns the next initial state message."""
+        with self.lock:
+            if not self.states:
+                self._fill()
+            return self.states.popleft()
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Simplified longitudinal model of a Cessna 172 gliding with idle engine (no thrust).
+# Coefficients roughly after Roskam, Airplane Flight Dynamics, Part I, Appendix B (Cessna 182 as close relative)
+# with Cm0 adjusted so that the plane is trimmed at ~75 KIAS with neutral elevator.
+MASS = 1043.0           # [kg] 2300 lbs
+WING_AREA = 16.2        # [m^2]
+CHORD = 1.49            # [m] mean aerodynamic chord
+I_YY = 1825.0           # [kg m^2] pitch moment of inertia
+G = 9.81                # [m/s^2]
+RHO_0 = 1.225           # [kg/m^3] air density at sea level
+SCALE_HEIGHT = 8500.0   # [m] for the exponential atmosphere
+
+CL_0 = 0.31
+CL_ALPHA = 5.143
+CL_Q = 3.9
+CL_DE = 0.43
+ALPHA_STALL = np.deg2rad(16.0)
+CL_ALPHA_POST_STALL = -2.0  # lift breaks down beyond the stall angle
+CD_0 = 0.031
+K_INDUCED = 0.054
+CM_0 = 0.06
+CM_ALPHA = -0.89
+CM_Q = -12.4
+CM_DE = -1.28
+ELEVATOR_MAX = np.deg2rad(25.0)  # full yoke deflection
+ALPHA_STALL_WARNING = np.deg2rad(14.0)
+
+# columns of the state array
+V, GAMMA, THETA, Q, H = range(5)
+STATE_SIZE = 5
+
+def airDensity(h):
+    return RHO_0 * np.exp(-h / SCALE_HEIGHT)
+
+def indicatedAirspeed(v, h):
+    """the indicated airspeed [m/s] for the true airspeed v at altitude h"""
+    return v * np.sqrt(airDensity(h) / RHO_0)
+
+def liftCoefficient(alpha, qHat, de):
+    clAlpha = np.where(alpha <= ALPHA_STALL, CL_ALPHA * alpha,
+                       CL_ALPHA * ALPHA_STALL + CL_ALPHA_POST_STALL * (alpha - ALPHA_STALL))
+    return CL_0 + clAlpha + CL_Q * qHat + CL_DE * de
+
+def longitudinalDerivatives(state, yoke):
+    """
+    Returns the time derivatives of the state.
+
+    Args
+    ----
+    state: array of shape (..., STATE_SIZE) holding true airspeed V [m/s], flight path angle gamma [rad],
+    pitch theta [rad], pitch rate Q [rad/s] and altitude h [m] in its last axis.
+
+    yoke: the yoke_pitch_ratio [-1...1] (pulling is positive); broadcastable to state[..., 0]
+    """
+    v, gamma, theta, q, h = np.moveaxis(state, -1, 0)
+    alpha = theta - gamma
+    de = -yoke * ELEVATOR_MAX   # pulling deflects the trailing edge upwards
+    qHat = q * CHORD / (2 * v)
+    qbarS = 0.5 * airDensity(h) * v**2 * WING_AREA
+    cl = liftCoefficient(alpha, qHat, de)
+    cd = CD_0 + K_INDUCED * cl**2
+    cm = CM_0 + CM_ALPHA * alpha + CM_Q * qHat + CM_DE * de
+    derivatives = np.empty_like(state)
+    derivatives[..., V] = (-qbarS * cd) / MASS - G * np.sin(gamma)
+    derivatives[..., GAMMA] = (qbarS * cl) / (MASS * v) - G * np.cos(gamma) / v
+    derivatives[..., THETA] = q
+    derivatives[..., Q] = qbarS * CHORD * cm / I_YY
+    derivatives[..., H] = v * np.sin(gamma)
+    return derivatives
+
+def integrate(state, yoke, dt, substeps=2):
+    """Advances the state by dt seconds with a classical Runge-Kutta scheme. Returns the new state array."""
+    h = dt / substeps
+    for _ in range(substeps):
+        k1 = longitudinalDerivatives(state, yoke)
+        k2 = longitudinalDerivatives(state + 0.5 * h * k1, yoke)
+        k3 = longitudinalDerivatives(state + 0.5 * h * k2, yoke)
+        k4 = longitudinalDerivatives(state + h * k3, yoke)
+        state = state + (h / 6.0) * (k1 + 2 * k2 + 2 * k3 + k4)
+    return state
+
+def stateFromPlaneState(dataRefs, alpha):
+    """
+    Converts the dataRefs of a SET_PLANE_STATE message (see prepareInitialPlaneState()) into a model state.
+
+    The speed is taken from the velocity vector, the pitch from the quaternion and the altitude from local_y.
+    As the velocity vector of prepareInitialPlaneState() isn't exact yet, the flight path angle is derived
+    from the pitch and the given angle of attack alpha [rad].
+    The dataRefs may hold arrays of several states (see planeStateDataRefs()); the states are then stacked.
+    """
+    vWorld = np.stack([dataRefs['sim/flightmodel/position/local_vx'],
+                       dataRefs['sim/flightmodel/position/local_vy'],
+                       dataRefs['sim/flightmodel/position/local_vz']], axis=-1)
+    q = [dataRefs['sim/flightmodel/position/q[%d]' % i] for i in range(4)]
+    theta = np.arcsin(np.clip(2 * (q[0]*q[2] - q[1]*q[3]), -1.0, 1.0))
+    state = np.zeros(np.shape(theta) + (STATE_SIZE,))
+    state[..., V] = np.linalg.norm(vWorld, axis=-1)
+    state[..., THETA] = theta
+    state[..., GAMMA] = theta - alpha
+    state[..., H] = dataRefs['sim/flightmodel/position/local_y']
+    return state
+
+def rollFromPlaneState(dataRefs):
+    """Returns the roll angle [rad] of the quaternion in the dataRefs of a SET_PLANE_STATE message."""
+    q = [dataRefs['sim/flightmodel/position/q[%d]' % i] for i in range(4)]
+    return np.arctan2(2 * (q[0]*q[1] + q[2]*q[3]), 1 - 2 * (q[1]**2 + q[2]**2))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import json
+
+FRAME_DELIMITER = b'\f'     #every message of the DubinsPilot ends with a `\f` character; see SockServer.cpp
+MAX_FRAME_SIZE = 1 << 20    #a single message will never be that big; anything larger is garbage
+
+class FrameDecoder(object):
+    """
+    Incremental framing layer for the DubinsPilot socket stream.
+
+    The socket is a byte stream, so a single recv() may contain several messages, only a part of one
+    message or both. The FrameDecoder keeps the incomplete tail of the stream in a persistent buffer,
+    splits everything received so far at the `\\f` delimiter and decodes all complete messages at once.
+
+    Messages that can't be decoded and incomplete tails that have to be thrown away are counted in
+    droppedFrames, so the caller can report them instead of printing every single ValueError.
+
+    Args
+    ----
+    :param decode = json.loads: the function turning a single frame (bytes without delimiter) into a message
+
+    :param maxFrameSize = MAX_FRAME_SIZE: the maximum number of bytes buffered without seeing a delimiter
+    """
+    def __init__(self, decode=json.loads, maxFrameSize=MAX_FRAME_SIZE):
+        self.decode = decode
+        self.maxFrameSize = maxFrameSize
+        self.buffer = b''
+        self.decodedFrames = 0
+        self.droppedFrames = 0
+
+    def feed(self, data):
+        """
+        Appends the received bytes to the buffer and decodes all complete frames.
+
+        Args
+        ----
+        data (bytes): the chunk of bytes as received from the socket
+
+        Returns
+        -------
+        A list holding all decoded messages in the order they were received. May be empty.
+        """
+        if self.buffer:
+            data = self.buffer + data
+        frames = data.split(FRAME_DELIMITER)
+        self.buffer = frames.pop()  #the last element is the incomplete remainder (or b'')
+        if len(self.buffer) > self.maxFrameSize:
+            #no delimiter in sight; the stream is corrupt. Throw away and resync at the next delimiter
+            self.buffer = b''
+            self.droppedFrames += 1
+        messages = []
+        decode = self.decode
+        for frame in frames:
+            if not frame:
+                continue
+            try:
+                messages.append(decode(frame))
+            except ValueError:
+                self.droppedFrames += 1
+        self.decodedFrames += len(messages)
+        return messages
+
+    def reset(self):
+        """Throws away a partially received frame, e. g. after a reconnect."""
+        if self.buffer:
+            self.droppedFrames += 1
+        self.buffer = b''
+
+    def getStatistics(self):
+        """Returns a dict with the number of decoded and dropped frames so far."""
+        return {'decodedFrames': self.decodedFrames, 'droppedFrames': self.droppedFrames}
@@ -0,0 +1,97 @@
+from gym_XPlaneEEE.utils.dataCenter import FRAME_TIMEOUT
+
+# what to do when a step observes a stale frame
+FLAG = 'flag'   #only tag the info dict
+WAIT = 'wait'   #wait (at most waitTimeout) for a fresh frame before observing
+STALE_POLICIES = [FLAG, WAIT]
+
+class FrameMonitor(object):
+    """
+    Tells how fresh the frame observed by a step is.
+
+    check() tags the info dict of every step with the sequence number of the observed frame ('frameSeq'),
+    its age in seconds ('frameAge'), the number of frames received since the previous step but never observed
+    ('skippedFrames') and whether it is the same frame as in the previous step ('repeatedFrame'). A frame is
+    stale if it is repeated or older than maxFrameAge; stale frames are marked with info['staleFrame'].
+    The counts are summed up for getSummary(), to tell whether the control loop keeps up with the simulator.
+
+    Args
+    ----
+    :param maxFrameAge = None: the age [s] from which on a frame is stale; None to only treat repeated frames
+    as stale
+
+    :param stalePolicy = FLAG: FLAG to only mark stale frames, WAIT to first wait for a fresh frame
+
+    :param waitTimeout = FRAME_TIMEOUT: the seconds to wait for a fresh frame with the WAIT policy
+    """
+    def __init__(self, maxFrameAge=None, stalePolicy=FLAG, waitTimeout=FRAME_TIMEOUT):
+        if stalePolicy not in STALE_POLICIES:
+            raise ValueError("stalePolicy must be one of {}, not {}".format(STALE_POLICIES, stalePolicy))
+        self.maxFrameAge = maxFrameAge
+        self.stalePolicy = stalePolicy
+        self.waitTimeout = waitTimeout
+        self.lastSeq = None
+        self.resetStatistics()
+
+    def resetStatistics(self):
+        self.steps = 0
+        self.repeatedFrames = 0
+        self.skippedFrames = 0
+        self.staleFrames = 0
+        self.staleWaits = 0
+        self.totalFrameAge = 0.0
+        self.maxObservedAge = 0.0
+
+    def restart(self, dc):
+        """Counts the skipped frames of the next step from the latest frame of dc, e. g. at the end of reset()."""
+        self.lastSeq = dc.frameSeq
+
+    def _isStale(self, seq, age):
+        return seq == self.lastSeq or (self.maxFrameAge is not None and age is not None and age > self.maxFrameAge)
+
+    def check(self, dc, info, snapshot=None):
+        """
+        Tags info with the freshness of the frame of snapshot (the latest frame of dc if None), which the step is
+        about to observe.
+
+        Returns
+        -------
+        The snapshot to observe: the given one or, with the WAIT policy, the fresh one waited for.
+        """
+        if snapshot is None:
+            snapshot = dc.getSnapshot()
+        seq, age = snapshot[0], dc.frameAge(snapshot=snapshot)
+        if self.stalePolicy == WAIT and self._isStale(seq, age):
+            self.staleWaits += 1
+            dc.waitForFrame(seq + 1, self.waitTimeout)
+            snapshot = dc.getSnapshot()
+            seq, age = snapshot[0], dc.frameAge(snapshot=snapshot)
+        repeated = seq == self.lastSeq
+        skipped = max(0, seq - self.lastSeq - 1) if self.lastSeq is not None else 0
+        info['frameSeq'] = seq
+        info['frameAge'] = age
+        info['skippedFrames'] = skipped
+        info['repeatedFrame'] = repeated
+        self.steps += 1
+        self.repeatedFrames += repeated
+        self.skippedFrames += skipped
+        if self._isStale(seq, age):
+            info['staleFrame'] = True
+            self.staleFrames += 1
+        if age is not None:
+            self.totalFrameAge += age
+            self.maxObservedAge = max(self.maxObservedAge, age)
+        self.lastSeq = seq
+        return snapshot
+
+    def getSummary(self):
+        """
+        Returns
+        -------
+        A dict with the number of steps, repeated, skipped and stale frames, waits for fresh frames and the mean and
+        maximum frame age [s] since the last resetStatistics().
+        """
+        return {'steps': self.steps, 'repeatedFrames': self.repeatedFrames, 'skippedFrames': self.skippedFrames,
+                'staleFrames': self.staleFrames, 'staleWaits': self.staleWaits,
+                'meanFrameAge': self.totalFrameAge / self.steps if self.steps else 0.0,
+                'maxFrameAge': self.maxObservedAge}
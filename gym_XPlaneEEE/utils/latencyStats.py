@@ -0,0 +1,99 @@
+import time
+from bisect import bisect_right
+from threading import Lock
+import numpy as np
+
+# upper bucket edges [s]: 4 buckets per decade from 1 µs to 10 s; everything slower goes into the last bucket
+LATENCY_BUCKETS = np.logspace(-6, 1, 29)
+
+# the stages of an env step
+SEND = 'send'                   #serialization and sending of the action in _take_action()
+WAIT = 'wait'                   #waiting for the frame answering the action
+DECODE = 'decode'               #framing and decoding of a received datagram in the listener
+OBSERVATION = 'observation'     #extraction of the observation from the DataCenter
+REWARD = 'reward'
+SCHEDULE = 'schedule'           #deliberate waiting of a wrapper for its time slot (see TimedActions)
+WRAPPER_PREFIX = 'wrapper.'     #the own processing of a wrapper layer, e. g. 'wrapper.TimeLimit'
+
+class LatencyHistogram(object):
+    """Counts durations in the fixed LATENCY_BUCKETS and keeps their sum and maximum."""
+    def __init__(self):
+        self.edges = LATENCY_BUCKETS.tolist()   #bisect on a list is much faster than np.searchsorted on a scalar
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """The upper bucket edge (at most the maximum) below which q percent of the durations lie."""
+        if not self.count:
+            return 0.0
+        idx = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        return min(self.edges[idx], self.max) if idx < len(self.edges) else self.max
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(50), 'p99': self.percentile(99), 'max': self.max}
+
+class LatencyStats(object):
+    """
+    Latency histograms of the stages of env steps (see SEND, WAIT, DECODE, OBSERVATION, REWARD and
+    WRAPPER_PREFIX). Pass an instance as latencyStats to the XPlane envs to have their steps timed.
+
+    Recording is guarded by a lock, so one instance can be shared by several envs stepped from different threads
+    (e. g. the sub-envs of an XplaneEEEVectorEnv) and by their listeners. Recording costs one bisect, a few
+    additions and the (mostly uncontended) lock.
+
+    Args
+    ----
+    :param dumpInterval = None: print the summary every dumpInterval seconds (checked when recording);
+    None to only query it with getSummary()
+    """
+    def __init__(self, dumpInterval=None):
+        self.histograms = {}
+        self.dumpInterval = dumpInterval
+        self.nextDump = time.monotonic() + dumpInterval if dumpInterval is not None else None
+        self.lock = Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.record(seconds)
+            dumpDue = self.nextDump is not None and time.monotonic() >= self.nextDump
+            if dumpDue:
+                self.nextDump = time.monotonic() + self.dumpInterval
+        if dumpDue:
+            self.dump()
+
+    def getHistogram(self, stage):
+        return self.histograms.get(stage)
+
+    def getSummary(self):
+        """
+        Returns
+        -------
+        A dict holding count, mean, p50, p99 and max [s] of every stage recorded so far.
+        """
+        with self.lock:
+            return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def dump(self):
+        print("{:<28}{:>10}{:>12}{:>12}{:>12}{:>12}".format('stage', 'count', 'mean [ms]', 'p50 [ms]', 'p99 [ms]',
+                                                            'max [ms]'))
+        for stage, summary in sorted(self.getSummary().items()):
+            print("{:<28}{:>10}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}".format(
+                stage, summary['count'], 1000 * summary['mean'], 1000 * summary['p50'], 1000 * summary['p99'],
+                1000 * summary['max']))
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+import os
+import os.path
+import socket
+import time
+from threading import Thread, Lock
+
+from gym_XPlaneEEE.utils.telemetryRecorder import TelemetryLog
+from gym_XPlaneEEE.utils.xPlaneGymCalculations import eulerAnglesFromQuaternion
+
+SIM_FRAME_TIME = 0.05   #seconds of simulated flight per frame
+
+# a plausible PLANE_STATE in a stable glide; holds all the datarefs used by the envs
+DEFAULT_PLANE_STATE = {
+    'indicated_airspeed_ms': 36.0,
+    'true_airspeed': 38.6,
+    'vh_ind': -4.0,
+    'h_ind': 4900.0,
+    'alpha': 2.0,
+    'true_theta': -4.0,
+    'true_phi': 0.0,
+    'true_psi': 0.0,
+    'local_vx': 0.0,    #east
+    'local_vy': -4.0,   #up
+    'local_vz': -38.39, #south
+    'vpath': -6.0,
+    'Prad': 0.0,
+    'Qrad': 0.0,
+    'Rrad': 0.0,
+    'stallWarning': 0,
+    'yoke_pitch_ratio': 0.0,
+    'yoke_roll_ratio': 0.0,
+    'targetValues': {'requestedClimbRate': -6.0, 'requestedRoll': 0.0},
+    'simTime': 0.0,
+    'simFrame': 0,
+    'ackRequestId': 0,
+}
+# the values kept by the mock itself when replaying recorded frames
+MOCK_CLOCK_KEYS = ['simTime', 'simFrame', 'ackRequestId']
+
+class MockDubinsPilot(object):
+    """
+    A local stand-in for DubinsPilot, serving the same JSON protocol with `\\f` framing on a Unix socket.
+
+    In free running mode, the current PLANE_STATE is published publishRate times per (wall clock) second.
+    In lockstep mode (publishRate = 0), the simulation only advances when a SET_ELEVATOR message asks for it
+    with 'advanceFrames' in its data. The PLANE_STATE answering such a request carries the request's id in
+    'ackRequestId' and the simulation clock in 'simFrame' and 'simTime'.
+
+    The mock doesn't fly. Received controls are just reflected in the published state, a SET_PLANE_STATE is taken
+    over at once and without any transient (unlike X-Plane, so resets against the mock are faster than against
+    the real simulator). Alternatively, the states
+    recorded by a TelemetryRecorder can be replayed: every frame the simulation advances loads the next recorded
+    state (the mock's clock and acknowledgement values are kept). Without publishRate, the frames are then
+    published with their recorded timing.
+
+    Args
+    ----
+    :param socketName: the Unix socket to listen on
+
+    :param publishRate = 10.0: PLANE_STATEs per second; 0 for lockstep mode only; None for the recorded timing
+    of the replayLog
+
+    :param replayLog = None: a TelemetryLog (or its directory) holding the states to replay
+
+    :param replaySpeed = 1.0: the factor speeding up the recorded timing
+
+    :param replayLoop = True: start over at the end of the replayLog; otherwise the last state is kept
+
+    :param extraDataRefs = 0: the number of additional dummy datarefs in every PLANE_STATE, to get the message size
+    of the real DubinsPilot
+    """
+    def __init__(self, socketName, publishRate=10.0, replayLog=None, replaySpeed=1.0, replayLoop=True,
+                 extraDataRefs=0):
+        if publishRate is None and replayLog is None:
+            raise ValueError("publishRate None (the recorded timing) needs a replayLog")
+        self.socketName = socketName
+        self.publishRate = publishRate
+        self.replaySpeed = replaySpeed
+        self.replayLoop = replayLoop
+        self.planeState = copy.deepcopy(DEFAULT_PLANE_STATE)
+        for idx in range(extraDataRefs):
+            self.planeState['sim/dummy/dataref_%d' % idx] = 0.001 * idx
+        self.replayColumns = None
+        self.replayStates = None
+        self.replayTimes = None
+        self.replayIdx = -1
+        if replayLog is not None:
+            self._loadReplay(replayLog)
+        self.stateLock = Lock()
+        self.connections = []
+        self.server = None
+        self.continueFlag = False
+        self.receivedMessages = 0
+
+    def start(self):
+        if os.path.exists(self.socketName):
+            os.remove(self.socketName)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socketName)
+        self.server.listen(8)
+        self.continueFlag = True
+        self._startThread(self._acceptConnections)
+        if self.publishRate is None or self.publishRate > 0:
+            self._startThread(self._publish)
+        return self
+
+    def stop(self):
+        self.continueFlag = False
+        for conn in list(self.connections):
+            self._closeConnection(conn)
+        if self.server:
+            self.server.close()
+            self.server = None
+        if os.path.exists(self.socketName):
+            os.remove(self.socketName)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _startThread(self, target, *args):
+        thread = Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _closeConnection(self, conn):
+        if conn in self.connections:
+            self.connections.remove(conn)
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        conn.close()
+
+    def _acceptConnections(self):
+        while self.continueFlag:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break   #server socket closed
+            self.connections.append(conn)
+            self._startThread(self._serve, conn)
+
+    def _serve(self, conn):
+        decoder = json.JSONDecoder()
+        buffer = ''
+        while self.continueFlag:
+            try:
+                data = conn.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            #the clients send plain concatenated JSON objects without delimiter
+            buffer += data.decode('utf-8').replace('\f', '')
+            while buffer:
+                try:
+                    message, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break   #incomplete message, wait for more data
+                buffer = buffer[end:].lstrip()
+                self.receivedMessages += 1
+                self.handleMessage(conn, message)
+        self._closeConnection(conn)
+
+    def handleMessage(self, conn, message):
+        """Applies a message received from a client. May answer the request on conn."""
+        msgType = message.get('type')
+        data = message.get('data', {})
+        if msgType == 'SET_ELEVATOR':
+            with self.stateLock:
+                self.planeState['yoke_pitch_ratio'] = data.get('yoke_pitch_ratio', 0.0)
+            if 'advanceFrames' in data:
+                self.advance(int(data['advanceFrames']))
+                with self.stateLock:
+                    self.planeState['ackRequestId'] = message.get('requestId', 0)
+                self._sendState(conn)
+        elif msgType == 'SET_PLANE_STATE':
+            with self.stateLock:
+                if 'sim/flightmodel/position/local_y' in data:
+                    self.planeState['h_ind'] = data['sim/flightmodel/position/local_y'] * 3.28084   #h_ind is in feet
+                if 'sim/flightmodel/position/local_vy' in data:
+                    velocity = [data.get('sim/flightmodel/position/local_v' + axis, 0.0) for axis in 'xyz']
+                    for axis, value in zip('xyz', velocity):
+                        self.planeState['local_v' + axis] = value
+                    self.planeState['true_airspeed'] = sum(v * v for v in velocity) ** 0.5
+                    self.planeState['vh_ind'] = velocity[1]
+                if 'sim/flightmodel/position/q[0]' in data:
+                    angles = eulerAnglesFromQuaternion([data['sim/flightmodel/position/q[%d]' % idx] for idx in range(4)])
+                    for key, angle in zip(['true_psi', 'true_theta', 'true_phi'], angles):
+                        self.planeState[key] = float(angle)
+                self.planeState['Prad'] = 0.0
+                self.planeState['Qrad'] = 0.0
+                self.planeState['Rrad'] = 0.0
+
+    def _loadReplay(self, replayLog):
+        if not isinstance(replayLog, TelemetryLog):
+            replayLog = TelemetryLog(replayLog)
+        columns = replayLog.columns('states')
+        states = replayLog.table('states')
+        if not len(states):
+            raise ValueError("The telemetry log in {} holds no states to replay".format(replayLog.directory))
+        self.replayTimes = states[:, columns.index('timestamp')]
+        #the key paths of the replayed columns and their values
+        keep = [idx for idx, name in enumerate(columns) if name != 'timestamp' and name not in MOCK_CLOCK_KEYS]
+        self.replayColumns = [columns[idx].split('.') for idx in keep]
+        self.replayStates = states[:, keep].tolist()
+
+    def _loadReplayFrame(self, frames):
+        #call with the stateLock held
+        self.replayIdx += frames
+        if self.replayIdx >= len(self.replayStates):
+            self.replayIdx = self.replayIdx % len(self.replayStates) if self.replayLoop else len(self.replayStates) - 1
+        for keyPath, value in zip(self.replayColumns, self.replayStates[self.replayIdx]):
+            item = self.planeState
+            for subKey in keyPath[:-1]:
+                item = item.setdefault(subKey, {})
+            item[keyPath[-1]] = value
+
+    def advance(self, frames):
+        """Advances the simulation clock (and the replay) by the given number of frames."""
+        with self.stateLock:
+            self.planeState['simFrame'] += frames
+            self.planeState['simTime'] = self.planeState['simFrame'] * SIM_FRAME_TIME
+            if self.replayStates is not None:
+                self._loadReplayFrame(frames)
+
+    def burst(self, frames):
+        """
+        Advances the simulation frame by frame and sends all the PLANE_STATEs to every client at once.
+        Useful to measure the throughput of the clients.
+        """
+        messages = []
+        for _ in range(frames):
+            self.advance(1)
+            messages.append(self.encodeState())
+        data = b''.join(messages)
+        for conn in list(self.connections):
+            try:
+                conn.sendall(data)
+            except OSError:
+                self._closeConnection(conn)
+
+    def encodeState(self):
+        with self.stateLock:
+            message = {'type': 'PLANE_STATE', 'requestId': 0, 'data': self.planeState}
+            return json.dumps(message).encode('utf-8') + b'\f'
+
+    def _sendState(self, conn):
+        try:
+            conn.sendall(self.encodeState())
+        except OSError:
+            self._closeConnection(conn)
+
+    def _publishDelay(self):
+        if self.publishRate is not None:
+            return 1.0 / self.publishRate
+        #the recorded time until the next frame
+        idx = self.replayIdx
+        if idx + 1 >= len(self.replayTimes):
+            return 0.0 if self.replayLoop else 1.0 / self.replaySpeed
+        return max(0.0, self.replayTimes[idx + 1] - self.replayTimes[idx]) / self.replaySpeed
+
+    def _publish(self):
+        nextPublishTime = time.monotonic()
+        while self.continueFlag:
+            self.advance(1)
+            for conn in list(self.connections):
+                self._sendState(conn)
+            nextPublishTime += self._publishDelay()
+            time.sleep(max(0.0, nextPublishTime - time.monotonic()))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Serves the DubinsPilot protocol on a Unix socket without X-Plane.")
+    parser.add_argument("-s", "--socket", default="/tmp/eee_AutoViewer", help="the socket to listen on")
+    parser.add_argument("-r", "--rate", type=float, default=None,
+                        help="PLANE_STATEs per second (default 10, or the recorded timing with --replay); "
+                             "0 for lockstep mode only")
+    parser.add_argument("--replay", help="directory of a telemetry log to replay; published with the recorded "
+                                         "timing unless --rate is given")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+    args = parser.parse_args()
+    rate = 10.0 if args.rate is None and args.replay is None else args.rate
+    mock = MockDubinsPilot(args.socket, publishRate=rate, replayLog=args.replay, replaySpeed=args.speed).start()
+    print("Mock DubinsPilot listening on {}. Ctrl-C to quit.".format(args.socket))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import numpy as np
+
+_NUMBER = rb'(-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|true|false|null)'
+_LITERALS = {b'true': 1.0, b'false': 0.0, b'null': np.nan}
+_TYPE_PATTERN = re.compile(rb'"type"\s*:\s*"([^"]*)"')
+VERIFY_INTERVAL = 1000  #PLANE_STATEs between two cross-checks of the fast path
+
+def normalizeKeyPath(key):
+    """Turns a key as used in DataCenter.getObservation() (string or list of subkeys) into a hashable tuple."""
+    if isinstance(key, (list, tuple)):
+        return tuple(key)
+    return (key,)
+
+def _compileKeyPattern(keyPath):
+    """
+    Compiles a regex extracting the numeric value of keyPath from the raw JSON text.
+    Nested keys are only searched inside the object of their parent key. Top level keys are searched in the whole
+    text, nested objects included, so their names must not appear anywhere else in the message.
+    """
+    pattern = rb''
+    for subKey in keyPath[:-1]:
+        pattern += b'"' + re.escape(subKey.encode('utf-8')) + rb'"\s*:\s*\{[^{}]*?'
+    pattern += b'"' + re.escape(keyPath[-1].encode('utf-8')) + rb'"\s*:\s*' + _NUMBER
+    return re.compile(pattern)
+
+class PlaneStateDecoder(object):
+    """
+    Schema-aware decoder for PLANE_STATE messages.
+
+    Instead of building the full nested dictionary with json.loads() for every frame, the decoder is compiled once
+    from the keys the active environment needs and extracts only these values straight into a float64 record.
+    The column of each key in the record is given by indexOf().
+
+    The fast path assumes the DubinsPilot message layout: numeric values, every key name appearing only once in the
+    whole message (a top level key would also match a key of the same name inside a nested object) and nested keys
+    (e. g. ['targetValues','requestedClimbRate']) living in flat subobjects. The first PLANE_STATE decoded is
+    cross-checked against a full json.loads(), and so is every VERIFY_INTERVAL-th one and every one with a different
+    number of (nested) objects than the last checked; if the results differ, the decoder falls back to the full
+    parser for good. Messages of other types are always handed over to json.loads().
+
+    Args
+    ----
+    :param keyList: the keys to extract; a string for top level keys, a list of subkeys for nested ones.
+    None entries (placeholders as used in DataCenter.getObservation()) are ignored.
+    """
+    def __init__(self, keyList):
+        self.keyPaths = []
+        for key in keyList:
+            if key is None:
+                continue
+            keyPath = normalizeKeyPath(key)
+            if keyPath not in self.keyPaths:
+                self.keyPaths.append(keyPath)
+        self.index = {keyPath: idx for idx, keyPath in enumerate(self.keyPaths)}
+        self.patterns = [_compileKeyPattern(keyPath) for keyPath in self.keyPaths]
+        self.verified = False
+        self.fastPath = True
+        self.objectCount = None     #the number of '{' in the last verified frame
+        self.uncheckedFrames = 0
+
+    def __len__(self):
+        return len(self.keyPaths)
+
+    def indexOf(self, key):
+        """Returns the column of the given key (string or list of subkeys) in the decoded record."""
+        return self.index[normalizeKeyPath(key)]
+
+    def newRecord(self):
+        """Returns a preallocated record suitable for decodeInto()."""
+        return np.zeros(len(self.keyPaths))
+
+    def __call__(self, frame):
+        """
+        Decodes a single frame (bytes without the `\\f` delimiter). Can be used as decode function of the FrameDecoder.
+
+        Returns
+        -------
+        A message dictionary. For PLANE_STATE messages 'data' holds the float64 record instead of the nested dict.
+        """
+        typeMatch = _TYPE_PATTERN.search(frame)
+        if typeMatch is None or typeMatch.group(1) != b'PLANE_STATE':
+            return json.loads(frame)
+        record = np.empty(len(self.keyPaths))
+        self.decodeInto(frame, record)
+        return {'type': 'PLANE_STATE', 'data': record}
+
+    def decodeInto(self, frame, record):
+        """
+        Writes the values of the PLANE_STATE frame into the given record.
+        Raises ValueError if the frame doesn't hold all keys.
+        """
+        if self.fastPath:
+            self.uncheckedFrames += 1
+            objectCount = frame.count(b'{')
+            if not self.verified or objectCount != self.objectCount or self.uncheckedFrames >= VERIFY_INTERVAL:
+                self._verify(frame)
+                self.objectCount = objectCount
+                self.uncheckedFrames = 0
+        if self.fastPath:
+            for idx, pattern in enumerate(self.patterns):
+                match = pattern.search(frame)
+                if match is None:
+                    raise ValueError("Key {} not found in PLANE_STATE".format(self.keyPaths[idx]))
+                value = match.group(1)
+                record[idx] = _LITERALS[value] if value in _LITERALS else float(value)
+        else:
+            self._decodeFull(json.loads(frame)['data'], record)
+        return record
+
+    def _decodeFull(self, planeState, record):
+        try:
+            for idx, keyPath in enumerate(self.keyPaths):
+                retrievedItem = planeState
+                for subKey in keyPath:
+                    retrievedItem = retrievedItem[subKey]
+                record[idx] = np.nan if retrievedItem is None else retrievedItem
+        except (KeyError, TypeError) as inst:
+            raise ValueError("Malformed PLANE_STATE: {}".format(inst))
+        return record
+
+    def _verify(self, frame):
+        """Cross-checks the fast path against the full parser (see the class docstring for when)."""
+        expected = self._decodeFull(json.loads(frame)['data'], self.newRecord())
+        try:
+            fast = self.newRecord()
+            for idx, pattern in enumerate(self.patterns):
+                value = pattern.search(frame).group(1)
+                fast[idx] = _LITERALS[value] if value in _LITERALS else float(value)
+            self.fastPath = np.array_equal(fast, expected, equal_nan=True)
+        except AttributeError:  #a key couldn't be found by its pattern
+            self.fastPath = False
+        if not self.fastPath:
+            print("PlaneStateDecoder: fast path doesn't match the message layout. Falling back to full JSON parsing.")
+        self.verified = True
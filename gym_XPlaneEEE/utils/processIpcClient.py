@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+import json
+import multiprocessing
+import os.path
+import select
+import signal
+import socket
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from gym_XPlaneEEE.utils.dataCenter import DataCenter
+from gym_XPlaneEEE.utils.frameDecoder import FrameDecoder
+from gym_XPlaneEEE.utils.planeStateDecoder import PlaneStateDecoder
+
+RECV_BUFFER_SIZE = 65536
+SHARED_SLOTS = 64   #frames kept in the shared memory block; a published state stays valid for SHARED_SLOTS - 1 frames
+READER_JOIN_TIMEOUT = 2.0
+READER_POLL_INTERVAL = 0.05 #s between two looks of the reader process at its stop event
+# the int64 header of the shared memory block
+HEADER_SIZE = 8
+SEQ, DECODED_FRAMES, DROPPED_FRAMES = range(3)
+
+def _frameBlockViews(buffer, slots, recordSize):
+    """Returns the header, timestamp and record views of a shared memory block (see ProcessIpcClient)."""
+    header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=buffer)
+    timestamps = np.ndarray((slots,), dtype=np.float64, buffer=buffer, offset=header.nbytes)
+    records = np.ndarray((slots, recordSize), dtype=np.float64, buffer=buffer,
+                         offset=header.nbytes + timestamps.nbytes)
+    return header, timestamps, records
+
+def _frameBlockSize(slots, recordSize):
+    return 8 * (HEADER_SIZE + slots + slots * recordSize)
+
+def _readFrames(client, sharedMemoryName, keyPaths, slots, frameCondition, stopEvent):
+    """
+    The reader process: decodes the PLANE_STATEs received on client into the slots of the shared memory block.
+    A frame is written completely before its sequence number is published in the header.
+    Runs until the connection is closed or stopEvent is set.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    #the parent process decides when to stop
+    sharedMemory = shared_memory.SharedMemory(name=sharedMemoryName)
+    header, timestamps, records = _frameBlockViews(sharedMemory.buf, slots, len(keyPaths))
+    decoder = FrameDecoder(PlaneStateDecoder(keyPaths))
+    seq = 0
+    try:
+        while not stopEvent.is_set():
+            #select() instead of a socket timeout, which would make the connection non-blocking for the parent too
+            readable, _, _ = select.select([client], [], [], READER_POLL_INTERVAL)
+            if not readable:
+                continue
+            datagram = client.recv(RECV_BUFFER_SIZE)
+            if not datagram:
+                break
+            receivedAt = time.monotonic()
+            published = False
+            for socketData in decoder.feed(datagram):
+                if socketData['type'] == 'PLANE_STATE':
+                    slot = seq % slots
+                    records[slot] = socketData['data']
+                    timestamps[slot] = receivedAt
+                    seq += 1
+                    header[SEQ] = seq
+                    published = True
+                else:
+                    print(json.dumps(socketData, sort_keys=True, indent=4))
+            header[DECODED_FRAMES] = decoder.decodedFrames
+            header[DROPPED_FRAMES] = decoder.droppedFrames
+            if published:
+                with frameCondition:
+                    frameCondition.notify_all()
+    except OSError as inst:
+        print(inst)
+    finally:
+        del header, timestamps, records
+        sharedMemory.close()
+
+class SharedStateDataCenter(DataCenter):
+    """
+    DataCenter reading the frames published by the reader process of a ProcessIpcClient.
+
+    There is no listener in this process: the latest frame is looked up in the shared memory block whenever the
+    snapshot is read. The plane state of a snapshot is a view into the block without any copy. It is valid until
+    SHARED_SLOTS - 1 further frames have been received; copy it to keep it longer.
+
+    Args
+    ----
+    :param frameCondition = None: the multiprocessing Condition the reader process notifies for every received
+    datagram; a new one if None is given
+    """
+    def __init__(self, frameCondition=None):
+        self.frameBlock = None
+        self.seqOffset = 0
+        DataCenter.__init__(self)
+        self.frameCondition = frameCondition if frameCondition is not None else \
+            multiprocessing.get_context('spawn').Condition()
+
+    @property
+    def snapshot(self):
+        self._refresh()
+        return self._snapshot
+
+    @snapshot.setter
+    def snapshot(self, snapshot):
+        self._snapshot = snapshot
+
+    def _refresh(self):
+        """Looks up the latest frame in the shared memory block."""
+        frameBlock = self.frameBlock
+        if frameBlock is not None:
+            seq = int(frameBlock[0][SEQ]) + self.seqOffset
+            if seq != self._snapshot[0]:
+                self._publishShared(seq, frameBlock)
+
+    def _publishShared(self, seq, frameBlock):
+        _, timestamps, records = frameBlock
+        slots = len(timestamps)
+        stateSchema = self._snapshot[2]
+        if self.history is not None:
+            #append the frames received since the last look into the block, as far as they are still there
+            try:
+                for frameSeq in range(max(self._snapshot[0] + 1, seq - slots + 1, self.seqOffset + 1), seq + 1):
+                    slot = (frameSeq - self.seqOffset - 1) % slots
+                    self.history.append(timestamps[slot], frameSeq, self.historyExtractor.extract(
+                        self.historyRow, (frameSeq, records[slot], stateSchema, timestamps[slot])))
+            except (KeyError, IndexError) as inst:
+                print("Couldn't append the frames to the history:", inst)  #publish the latest one nevertheless
+        slot = (seq - self.seqOffset - 1) % slots
+        self.observation = seq
+        self._snapshot = (seq, records[slot], stateSchema, float(timestamps[slot]))
+
+    def attachFrameBlock(self, header, timestamps, records):
+        """Starts reading from a new shared memory block. Its sequence numbers continue the ones seen so far."""
+        self.seqOffset = self.snapshot[0]
+        self.frameBlock = (header, timestamps, records)
+
+    def detachFrameBlock(self):
+        """Stops reading from the shared memory block. The latest state is copied out of it."""
+        seq, planeState, stateSchema, timestamp = self.snapshot
+        self.frameBlock = None
+        self._snapshot = (seq, None if planeState is None else planeState.copy(), stateSchema, timestamp)
+
+    def putState(self, planeState, timestamp=None):
+        raise RuntimeError("The states of a SharedStateDataCenter are published by the reader process")
+
+class ProcessIpcClient(object):
+    """
+    Reads the DubinsPilot socket in a separate process, so frame handling doesn't compete with the training loop
+    for the GIL.
+
+    The reader process decodes every PLANE_STATE with the PlaneStateDecoder set by setStateDecoder() and writes the
+    record, its receive timestamp and its sequence number into a multiprocessing.shared_memory block holding the
+    last SHARED_SLOTS frames. The SharedStateDataCenter of the client reads the latest frame straight from there.
+    Controls are sent from this process on the same connection, which the reader process only reads from.
+
+    Recording isn't supported, as the frames never pass through this process.
+
+    Args
+    ----
+    :param dataCenter = None: the SharedStateDataCenter to publish to; a new one if None is given
+
+    :param slots = SHARED_SLOTS: the number of frames kept in the shared memory block
+    """
+    def __init__(self, dataCenter=None, slots=SHARED_SLOTS):
+        self.context = multiprocessing.get_context('spawn')
+        self.dc = dataCenter if dataCenter is not None else SharedStateDataCenter(self.context.Condition())
+        if not isinstance(self.dc, SharedStateDataCenter):
+            raise TypeError("A ProcessIpcClient needs a SharedStateDataCenter")
+        self.slots = slots
+        self.client = None
+        self.socketName = None
+        self.stateDecoder = None
+        self.reader = None
+        self.stopEvent = None
+        self.sharedMemory = None
+        self.daemon = True  #only for compatibility with the IpcClient thread interface
+
+    def connect(self, socketName):
+        self.setContinueFlag(False)
+        self.socketName = socketName
+        print("Connecting...")
+        if not os.path.exists(socketName):
+            raise ConnectionError(socketName, " does not exist. Quitting!")
+        self.client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.client.connect(socketName)
+        except OSError:
+            self.client = None
+            raise ConnectionError("couldn't connect to ", socketName, ". Quitting!")
+
+    def getSocketName(self):
+        return self.socketName
+
+    def setStateDecoder(self, stateDecoder):
+        """
+        Sets the PlaneStateDecoder the reader process decodes with. A running reader process is restarted,
+        frames arriving in between may be lost.
+        """
+        self.stateDecoder = stateDecoder
+        self.dc.setStateSchema(stateDecoder)
+        if self.reader is not None:
+            self._stopReader()
+            self._startReader()
+
+    def setRecorder(self, recorder):
+        if recorder is not None:
+            raise ValueError("The ProcessIpcClient can't record; use transport 'thread' or 'asyncio' to record.")
+
+    def setLatencyStats(self, latencyStats):
+        """The decoding happens in the reader process and isn't timed."""
+        pass
+
+    def getDecoderStatistics(self):
+        """Returns the number of decoded and dropped frames of the current connection."""
+        if self.dc.frameBlock is None:
+            return {'decodedFrames': 0, 'droppedFrames': 0}
+        header = self.dc.frameBlock[0]
+        return {'decodedFrames': int(header[DECODED_FRAMES]), 'droppedFrames': int(header[DROPPED_FRAMES])}
+
+    def start(self):
+        """Starts the reader process."""
+        if self.client is None:
+            raise ConnectionError("No connection to read from. Use connect(sn) before starting the reader.")
+        if self.stateDecoder is None:
+            raise ValueError("The reader process needs a PlaneStateDecoder. Use setStateDecoder() before start().")
+        self._startReader()
+
+    def _startReader(self):
+        recordSize = len(self.stateDecoder)
+        self.sharedMemory = shared_memory.SharedMemory(create=True, size=_frameBlockSize(self.slots, recordSize))
+        header, timestamps, records = _frameBlockViews(self.sharedMemory.buf, self.slots, recordSize)
+        header[:] = 0
+        self.dc.attachFrameBlock(header, timestamps, records)
+        self.stopEvent = self.context.Event()
+        self.reader = self.context.Process(target=_readFrames, name='ProcessIpcClientReader',
+                                           args=(self.client, self.sharedMemory.name, self.stateDecoder.keyPaths,
+                                                 self.slots, self.dc.frameCondition, self.stopEvent))
+        self.reader.daemon = True
+        self.reader.start()
+        print("Ready.")
+
+    def _stopReader(self):
+        if self.reader is not None:
+            self.stopEvent.set()
+            self.reader.join(READER_JOIN_TIMEOUT)
+            if self.reader.is_alive():
+                #last resort: a reader killed while holding the lock of the frame condition would leave it locked
+                self.reader.terminate()
+                self.reader.join()
+                self.dc.frameCondition = self.context.Condition()
+            self.reader = None
+            self.stopEvent = None
+        if self.sharedMemory is not None:
+            self.dc.detachFrameBlock()
+            try:
+                self.sharedMemory.close()
+            except BufferError:
+                pass    #views of the block are still referenced; it is unmapped once they are gone
+            self.sharedMemory.unlink()
+            self.sharedMemory = None
+
+    def setContinueFlag(self, flag):
+        if not flag and self.client is not None:
+            try:
+                self.client.shutdown(socket.SHUT_RDWR)  #ends the reader process
+            except OSError:
+                pass    #not connected any more
+            if self.reader is not None:
+                self.reader.join(READER_JOIN_TIMEOUT)
+            self._stopReader()
+            self.client.close()
+            self.client = None
+            print("continueFlag = False")
+
+    def socketSendData(self, msgTypeStr, requestId, dataDict):
+        if self.client is None:
+            print("No connection available. Try again later.")
+            return False
+        j = {}
+        j['type']      = msgTypeStr
+        j['requestId'] = requestId
+        j['data']      = dataDict
+        try:
+            self.client.sendall(json.dumps(j).encode('utf-8'))
+        except Exception as inst:
+            print(type(inst))    # the exception instance
+            print(inst.args)     # arguments stored in .args
+            print(inst)
+            return False
+        return True
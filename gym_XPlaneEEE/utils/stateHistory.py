@@ -0,0 +1,148 @@
+import numpy as np
+
+from gym_XPlaneEEE.utils.planeStateDecoder import normalizeKeyPath
+
+HISTORY_CAPACITY = 256  #frames; ~12 seconds of PLANE_STATEs at 20 Hz
+GUARD_SLOTS = 8         #slots beyond the capacity, written while a reader still copies the oldest frames
+
+class StateHistory(object):
+    """
+    Fixed capacity ring buffer of the last frames received, each with its receive timestamp and sequence number.
+
+    The ring has GUARD_SLOTS slots more than the capacity and every row is stored twice, at slot and slot + slots,
+    so the last k frames are always one contiguous block of the backing arrays. last() and rates() work on NumPy
+    views (oldest frame first). The views of last(k) are valid until capacity + GUARD_SLOTS - k further frames have
+    been appended; copy them to keep them longer.
+
+    There must be a single writer (the listener of the connection). Readers need no locking: the number of frames
+    is only increased after the row has been written completely, and since(), at() and averageRate() read it once
+    and search in a copy of the window, which stays intact as long as fewer than GUARD_SLOTS frames are appended
+    while it is copied.
+
+    Args
+    ----
+    :param keyList: the state values to keep (strings or lists of subkeys, as in DataCenter.getObservation())
+
+    :param capacity = HISTORY_CAPACITY: the number of frames to keep
+    """
+    def __init__(self, keyList, capacity=HISTORY_CAPACITY):
+        if capacity < 1:
+            raise ValueError("The capacity of a StateHistory must be positive, not {}".format(capacity))
+        self.keyList = keyList
+        self.keyPaths = [normalizeKeyPath(key) for key in keyList]
+        self.capacity = capacity
+        self.slots = capacity + GUARD_SLOTS
+        self.timestamps = np.zeros(2 * self.slots)
+        self.seqs = np.zeros(2 * self.slots, dtype=np.int64)
+        self.values = np.zeros((2 * self.slots, len(keyList)))
+        self.count = 0  #frames appended so far
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def indexOf(self, key):
+        """The column of key in the values returned by the queries."""
+        return self.keyPaths.index(normalizeKeyPath(key))
+
+    def clear(self):
+        self.count = 0
+
+    def append(self, timestamp, seq, values):
+        slot = self.count % self.slots
+        for row in (slot, slot + self.slots):
+            self.timestamps[row] = timestamp
+            self.seqs[row] = seq
+            self.values[row] = values
+        self.count += 1
+
+    def _window(self, k, count):
+        """The slice of the backing arrays holding the last k of count frames."""
+        k = min(k, count, self.capacity)
+        end = (count - 1) % self.slots + self.slots + 1
+        return slice(end - k, end)
+
+    def _copyAll(self):
+        """Copies of the timestamps, seqs and values of all frames kept."""
+        window = self._window(self.capacity, self.count)
+        return self.timestamps[window].copy(), self.seqs[window].copy(), self.values[window].copy()
+
+    def last(self, k=1):
+        """
+        Returns
+        -------
+        timestamps, seqs, values : views of shape (k,), (k,) and (k, len(keyList)) of the last k frames.
+        Fewer rows are returned if fewer frames were received.
+        """
+        window = self._window(k, self.count)
+        return self.timestamps[window], self.seqs[window], self.values[window]
+
+    def latest(self):
+        """Returns a view of the values of the latest frame, or None if there is none."""
+        if not self.count:
+            return None
+        return self.last(1)[2][0]
+
+    def since(self, seconds, now=None):
+        """
+        Returns
+        -------
+        timestamps, seqs, values : copies of all frames received within the last seconds (up to now,
+        which defaults to the timestamp of the latest frame)
+        """
+        timestamps, seqs, values = self._copyAll()
+        if not len(timestamps):
+            return timestamps, seqs, values
+        if now is None:
+            now = timestamps[-1]
+        start = np.searchsorted(timestamps, now - seconds, side='left')
+        return timestamps[start:], seqs[start:], values[start:]
+
+    def at(self, t):
+        """
+        Returns the values at time t (a scalar or an array of times), linearly interpolated between the frames.
+        Times before the oldest or after the latest frame are clamped to these frames.
+
+        Returns
+        -------
+        an array of shape (len(keyList),) for a scalar t or (len(t), len(keyList)) otherwise
+        """
+        timestamps, _, values = self._copyAll()
+        if not len(timestamps):
+            raise LookupError("The StateHistory is empty")
+        return self._interpolate(timestamps, values, t)
+
+    def _interpolate(self, timestamps, values, t):
+        t = np.asarray(t, dtype=np.float64)
+        if len(timestamps) == 1:
+            return np.broadcast_to(values[0], t.shape + values.shape[1:]).copy()
+        idx = np.clip(np.searchsorted(timestamps, t, side='right'), 1, len(timestamps) - 1)
+        t0, t1 = timestamps[idx - 1], timestamps[idx]
+        dt = t1 - t0
+        weight = np.clip(np.divide(t - t0, dt, out=np.zeros_like(dt), where=dt > 0), 0.0, 1.0)
+        return values[idx - 1] + weight[..., np.newaxis] * (values[idx] - values[idx - 1])
+
+    def rates(self, k=2):
+        """
+        Returns
+        -------
+        The finite difference rates (per second) between the last k frames in an array of shape
+        (k - 1, len(keyList)). Frames with the same timestamp give a rate of zero.
+        """
+        timestamps, _, values = self.last(k)
+        dt = np.diff(timestamps)[:, np.newaxis]
+        return np.divide(np.diff(values, axis=0), dt, out=np.zeros((len(dt), values.shape[1])), where=dt > 0)
+
+    def averageRate(self, seconds):
+        """
+        Returns
+        -------
+        The mean rate (per second) of all values over the last seconds, i.e. the difference between the latest
+        frame and the (interpolated) state seconds before. Zero if there aren't two frames yet.
+        """
+        timestamps, _, values = self._copyAll()
+        if len(timestamps) < 2:
+            return np.zeros(len(self.keyList))
+        start = max(timestamps[-1] - seconds, timestamps[0])
+        if start >= timestamps[-1]:
+            return np.zeros(len(self.keyList))
+        return (values[-1] - self._interpolate(timestamps, values, start)) / (timestamps[-1] - start)
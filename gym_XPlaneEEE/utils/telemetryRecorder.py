@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import os.path
+import queue
+import time
+from threading import Thread, Lock
+import numpy as np
+
+from gym_XPlaneEEE.utils.planeStateDecoder import normalizeKeyPath
+
+CHUNK_SIZE = 4096   #rows per chunk file
+SCHEMA_FILE = 'schema.json'
+ACTION_COLUMNS = ['timestamp', 'yoke_pitch_ratio', 'requestId']
+EPISODE_COLUMNS = ['timestamp', 'episode']
+PLANE_STATE_COLUMNS = ['timestamp', 'sim/flightmodel/position/local_vx', 'sim/flightmodel/position/local_vy',
+                       'sim/flightmodel/position/local_vz', 'sim/flightmodel/position/q[0]',
+                       'sim/flightmodel/position/q[1]', 'sim/flightmodel/position/q[2]',
+                       'sim/flightmodel/position/q[3]', 'sim/flightmodel/position/local_y']
+
+def columnName(key):
+    """The name of the column holding the state value of key (string or list of subkeys)."""
+    return '.'.join(normalizeKeyPath(key))
+
+class _Table(object):
+    """Collects the rows of one table in a preallocated chunk and hands full chunks over to the writer."""
+    def __init__(self, name, columns, chunkSize, writeQueue):
+        self.name = name
+        self.columns = columns
+        self.chunkSize = chunkSize
+        self.writeQueue = writeQueue
+        self.lock = Lock()
+        self.chunkNumber = 0
+        self._newChunk()
+
+    def _newChunk(self):
+        #Fortran order keeps every column contiguous in the chunk file
+        self.chunk = np.empty((self.chunkSize, len(self.columns)), order='F')
+        self.rows = 0
+
+    def append(self, row):
+        with self.lock:
+            self.chunk[self.rows] = row
+            self.rows += 1
+            if self.rows == self.chunkSize:
+                self._handOver()
+
+    def _handOver(self):
+        if self.rows:
+            self.writeQueue.put((self.name, self.chunkNumber, self.chunk[:self.rows]))
+            self.chunkNumber += 1
+        self._newChunk()
+
+    def flush(self):
+        with self.lock:
+            self._handOver()
+
+class TelemetryRecorder(object):
+    """
+    Records every received plane state, every sent control, every initial state set by a reset and the episode
+    boundaries to disk.
+
+    Each of the tables 'states', 'actions', 'planeStates' and 'episodes' is stored in chunks of chunkSize rows. Every chunk is a
+    float64 .npy file in column major order, so it can be memory mapped and sliced by column (see TelemetryLog).
+    The first column of every table is a time.monotonic() timestamp. The column names are stored in schema.json.
+
+    Recording only copies the values into a preallocated chunk; full chunks are written by a background thread,
+    so the IpcClient listener never waits for the disk.
+
+    Args
+    ----
+    :param directory: the directory to write the chunk files to; created if necessary
+
+    :param stateKeys: the state values to record (strings or lists of subkeys, as in DataCenter.getObservation())
+
+    :param chunkSize = CHUNK_SIZE: rows per chunk file
+    """
+    def __init__(self, directory, stateKeys, chunkSize=CHUNK_SIZE):
+        self.directory = directory
+        self.stateKeyPaths = [normalizeKeyPath(key) for key in stateKeys if key is not None]
+        self.stateSchema = None
+        os.makedirs(directory, exist_ok=True)
+        self.writeQueue = queue.Queue()
+        self.tables = {
+            'states': _Table('states', ['timestamp'] + [columnName(key) for key in self.stateKeyPaths],
+                             chunkSize, self.writeQueue),
+            'actions': _Table('actions', ACTION_COLUMNS, chunkSize, self.writeQueue),
+            'planeStates': _Table('planeStates', PLANE_STATE_COLUMNS, chunkSize, self.writeQueue),
+            'episodes': _Table('episodes', EPISODE_COLUMNS, chunkSize, self.writeQueue),
+        }
+        with open(os.path.join(directory, SCHEMA_FILE), 'w') as schemaFile:
+            json.dump({name: table.columns for name, table in self.tables.items()}, schemaFile, indent=4)
+        self.stateRow = np.empty(len(self.tables['states'].columns))
+        self.writer = Thread(target=self._write, name='TelemetryWriter')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def setStateSchema(self, stateSchema):
+        """Tells the recorder that the states are float64 records of the given PlaneStateDecoder."""
+        if stateSchema is not None:
+            self.stateColumns = np.array([stateSchema.indexOf(keyPath) for keyPath in self.stateKeyPaths], dtype=np.intp)
+        self.stateSchema = stateSchema
+
+    def recordState(self, planeState):
+        """Records a plane state as put into the DataCenter (nested dict or PlaneStateDecoder record)."""
+        row = self.stateRow
+        row[0] = time.monotonic()
+        if self.stateSchema is not None:
+            row[1:] = planeState[self.stateColumns]
+        else:
+            for idx, keyPath in enumerate(self.stateKeyPaths):
+                retrievedItem = planeState
+                for subKey in keyPath:
+                    retrievedItem = retrievedItem.get(subKey, np.nan) if isinstance(retrievedItem, dict) else np.nan
+                row[idx + 1] = np.nan if retrievedItem is None else retrievedItem
+        self.tables['states'].append(row)
+
+    def recordAction(self, yoke_pitch_ratio, requestId=0):
+        self.tables['actions'].append((time.monotonic(), yoke_pitch_ratio, requestId))
+
+    def recordPlaneState(self, dataRefs):
+        """Records the dataRefs of a SET_PLANE_STATE message; dataRefs missing in the message are NaN."""
+        self.tables['planeStates'].append([time.monotonic()] + [dataRefs.get(name, np.nan)
+                                                                for name in PLANE_STATE_COLUMNS[1:]])
+
+    def recordEpisodeStart(self, episode):
+        self.tables['episodes'].append((time.monotonic(), episode))
+
+    def flush(self, wait=True):
+        """Hands all buffered rows over to the writer. If wait is True, blocks until everything is on disk."""
+        for table in self.tables.values():
+            table.flush()
+        if wait:
+            self.writeQueue.join()
+
+    def close(self):
+        self.flush()
+        self.writeQueue.put(None)
+        self.writer.join()
+
+    def _write(self):
+        while True:
+            item = self.writeQueue.get()
+            try:
+                if item is None:
+                    break
+                name, chunkNumber, chunk = item
+                fileName = os.path.join(self.directory, '{}_{:06d}.npy'.format(name, chunkNumber))
+                np.save(fileName, np.asfortranarray(chunk))
+            except Exception as inst:
+                print(type(inst))    # the exception instance
+                print(inst)
+            finally:
+                self.writeQueue.task_done()
+
+class TelemetryLog(object):
+    """
+    Read access to the telemetry written by a TelemetryRecorder. The chunk files are memory mapped.
+
+    Args
+    ----
+    :param directory: the directory holding the chunk files and schema.json
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, SCHEMA_FILE)) as schemaFile:
+            self.schema = json.load(schemaFile)
+
+    def columns(self, table):
+        return self.schema[table]
+
+    def chunks(self, table):
+        """Returns the memory mapped chunks of the table in the order they were recorded."""
+        fileNames = sorted(glob.glob(os.path.join(self.directory, '{}_*.npy'.format(table))))
+        return [np.load(fileName, mmap_mode='r') for fileName in fileNames]
+
+    def table(self, table):
+        """Returns the whole table as a single (rows, columns) array. This copies the chunks into memory."""
+        chunks = self.chunks(table)
+        if not chunks:
+            return np.empty((0, len(self.columns(table))))
+        return np.concatenate(chunks)
+
+    def column(self, table, name):
+        """Returns a single column of the table as contiguous array."""
+        idx = self.columns(table).index(name)
+        chunks = self.chunks(table)
+        if not chunks:
+            return np.empty(0)
+        return np.concatenate([chunk[:, idx] for chunk in chunks])
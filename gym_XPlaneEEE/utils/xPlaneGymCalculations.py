@@ -16,7 +16,7 @@ PHI_AVG = 0  # roll
 PHI_STD_DEV = 10  # width of the roll distribution
 
 
-def prepareInitialPlaneState():
+def prepareInitialPlaneState(verbose=False, rng=None):
     """
     Prepares a dataset to reset the environment. This can be sent to X-Plane
     as JSON by means of the socket connction.
@@ -56,93 +56,110 @@ def prepareInitialPlaneState():
     The values for heading, roll, altitude and speed are drawn from a gaussian distribution. Additionally, the values for 
     flight path angle and angle of attack are drawn. The vertical speed (up) is calculated from the forward speed and vpath.
 
+    The states are drawn by drawInitialPlaneStates(); use it or prepareInitialPlaneStates() for many states at once.
+
     Args:
-        None
+        verbose: print the drawn roll, heading and pitch
+        rng: the np.random.Generator to draw from; the global np.random if None
     """
 
-    # draw the next values
-    nextAoA = np.random.normal(AOA_AVG, AOA_STD_DEV)
-    nextVPath = np.random.normal(VPATH_AVG, VPATH_STD_DEV)
-    nextFwdSpeed = np.random.normal(FWD_SPEED_AVG, FWD_SPEED_STD_DEV)
-    nextAltitude = np.random.normal(ALTITUDE_AVG, ALTITUDE_STD_DEV)
-    nextPsi = np.random.random_sample() * 360
-    nextPhi = np.random.normal(PHI_AVG, PHI_STD_DEV)
+    states = drawInitialPlaneStates(1, rng)
+    if verbose:
+        print(f'next Roll: {states["phi"][0]}, next Heading: {states["psi"][0]}, next Pitch: {states["theta"][0]}')
+    # prepare the entire message to be sent out to the DubinsPilot socket
+    message = {}
+    message['type'] = 'SET_PLANE_STATE'
+    message['data'] = planeStateDataRefs(states, 0)
+    return message
+
+
+def prepareInitialPlaneStates(n, rng=None):
+    """Returns a list of n SET_PLANE_STATE messages like prepareInitialPlaneState(), drawn in one vectorized pass."""
+    states = drawInitialPlaneStates(n, rng)
+    return [{'type': 'SET_PLANE_STATE', 'data': planeStateDataRefs(states, idx)} for idx in range(n)]
+
+
+def drawInitialPlaneStates(n, rng=None):
+    """
+    Draws n initial plane states at once (see prepareInitialPlaneState() for the distributions and formulae).
+
+    Args:
+        n: the number of states
+        rng: the np.random.Generator to draw from; the global np.random if None
+
+    Returns:
+        A dict of arrays with the leading dimension n: the drawn angles 'aoa', 'vpath', 'theta', 'psi', 'phi' [deg],
+        'fwdSpeed' [m/s] and 'altitude' [m], the quaternions 'q' (n, 4), the rotation matrices 'rotation' (n, 3, 3)
+        from body to XPlane world coordinates and the velocities 'vWorld' (n, 3) [m/s].
+    """
+    if rng is None:
+        rng = np.random
+    # draw the next values (in the order of the former scalar version)
+    aoa = rng.normal(AOA_AVG, AOA_STD_DEV, n)
+    vpath = rng.normal(VPATH_AVG, VPATH_STD_DEV, n)
+    fwdSpeed = rng.normal(FWD_SPEED_AVG, FWD_SPEED_STD_DEV, n)
+    altitude = rng.normal(ALTITUDE_AVG, ALTITUDE_STD_DEV, n)
+    psi = rng.random(n) * 360
+    phi = rng.normal(PHI_AVG, PHI_STD_DEV, n)
 
     # limit the values to lie within 5 *STD_DEV (avoid e. g. negative altitudes)
-    def clamp(n, minn, maxn): return max(min(maxn, n), minn)
-    nextAoA = clamp(nextAoA, AOA_AVG-5*AOA_STD_DEV, AOA_AVG+5*AOA_STD_DEV)
-    nextVPath = clamp(nextVPath, VPATH_AVG-5*VPATH_STD_DEV, VPATH_AVG+5*VPATH_STD_DEV)
-    nextFwdSpeed = clamp(nextFwdSpeed, FWD_SPEED_AVG-5*FWD_SPEED_STD_DEV, FWD_SPEED_AVG+5*FWD_SPEED_STD_DEV)
-    nextAltitude = clamp(nextAltitude, ALTITUDE_AVG-5*ALTITUDE_STD_DEV, ALTITUDE_AVG+5*ALTITUDE_STD_DEV)
-    nextPhi = clamp(nextPhi, PHI_AVG-5*PHI_STD_DEV, PHI_AVG+5*PHI_STD_DEV) #why is the phi so big in values?
+    aoa = np.clip(aoa, AOA_AVG-5*AOA_STD_DEV, AOA_AVG+5*AOA_STD_DEV)
+    vpath = np.clip(vpath, VPATH_AVG-5*VPATH_STD_DEV, VPATH_AVG+5*VPATH_STD_DEV)
+    fwdSpeed = np.clip(fwdSpeed, FWD_SPEED_AVG-5*FWD_SPEED_STD_DEV, FWD_SPEED_AVG+5*FWD_SPEED_STD_DEV)
+    altitude = np.clip(altitude, ALTITUDE_AVG-5*ALTITUDE_STD_DEV, ALTITUDE_AVG+5*ALTITUDE_STD_DEV)
+    phi = np.clip(phi, PHI_AVG-5*PHI_STD_DEV, PHI_AVG+5*PHI_STD_DEV)
 
     # calculate the dependant values
-    nextTheta = nextVPath + nextAoA
-    nextSinkSpeed = nextFwdSpeed * np.sin(np.deg2rad(nextVPath))
-
-    # # TODO remove again as this is just for checking
-    # from dataCenter import DataCenter
-    # dc = DataCenter.instance()
-    # if (planeState = dc.getState()):
-    #     quaternion = planeState['rotationQuat']
-    #     localVelocity = planeState['local_velocity']
-    #     airSpeed = planeState['true_airspeed']
-    #     sinkSpeed = planeState['vh_ind']
-    #     true_theta = planeState["true_theta"]
-    #     true_phi = planeState["true_phi"]
-    #     true_psi = planeState["true_psi"]
-    #     vPath = planeState['vpath']
-    #     alpha = planeState['alpha']
-
-    # nextPhi = true_phi
-    # nextPsi = true_psi
-    # nextVPath = vPath
-    # nextTheta = vPath + alpha
-    # nextFwdSpeed = airSpeed
-    nextSinkSpeed = nextFwdSpeed * np.sin(np.deg2rad(nextVPath))
+    theta = vpath + aoa
     # Allerton eq. 3.24  #TODO hier muss ich nochmal korrekt nachrechnen, aber für's erste tut's
-    nextSinkSpeed = -np.tan(np.deg2rad(nextAoA))*nextFwdSpeed
-    # nextUpSpeed = sinkSpeed / np.cos(np.deg2rad(true_theta))
-    nextUpSpeed = nextSinkSpeed / np.cos(np.deg2rad(nextTheta))
+    sinkSpeed = -np.tan(np.deg2rad(aoa))*fwdSpeed
 
     # calculate the quaternions See Allerton §3.6, p 122f.
-    q = np.zeros(4)
-    q[0] = np.cos(np.deg2rad(nextPsi/2)) * np.cos(np.deg2rad(nextTheta/2)) * np.cos(np.deg2rad(nextPhi/2)) + \
-        np.sin(np.deg2rad(nextPsi/2)) * \
-        np.sin(np.deg2rad(nextTheta/2)) * np.sin(np.deg2rad(nextPhi/2))
-    q[1] = np.cos(np.deg2rad(nextPsi/2)) * np.cos(np.deg2rad(nextTheta/2)) * np.sin(np.deg2rad(nextPhi/2)) - \
-        np.sin(np.deg2rad(nextPsi/2)) * \
-        np.sin(np.deg2rad(nextTheta/2)) * np.cos(np.deg2rad(nextPhi/2))
-    q[2] = np.cos(np.deg2rad(nextPsi/2)) * np.sin(np.deg2rad(nextTheta/2)) * np.cos(np.deg2rad(nextPhi/2)) + \
-        np.sin(np.deg2rad(nextPsi/2)) * \
-        np.cos(np.deg2rad(nextTheta/2)) * np.sin(np.deg2rad(nextPhi/2))
-    q[3] = -np.cos(np.deg2rad(nextPsi/2)) * np.sin(np.deg2rad(nextTheta/2)) * np.sin(np.deg2rad(nextPhi/2)) + \
-        np.sin(np.deg2rad(nextPsi/2)) * \
-        np.cos(np.deg2rad(nextTheta/2)) * np.cos(np.deg2rad(nextPhi/2))
-
-    # if np.amax(q) < -np.amin(q):  # make the biggest absolute value positive; see http://danceswithcode.net/engineeringnotes/quaternions/quaternions.html
-    #     q = -q
+    halfAngles = np.deg2rad(np.stack([psi, theta, phi]) / 2)
+    cPsi, cTheta, cPhi = np.cos(halfAngles)
+    sPsi, sTheta, sPhi = np.sin(halfAngles)
+    q = np.stack([cPsi*cTheta*cPhi + sPsi*sTheta*sPhi,
+                  cPsi*cTheta*sPhi - sPsi*sTheta*cPhi,
+                  cPsi*sTheta*cPhi + sPsi*cTheta*sPhi,
+                  -cPsi*sTheta*sPhi + sPsi*cTheta*cPhi], axis=-1)
+
     # see Allerton eq. 3.63
-    A = np.array([[q[0]**2 + q[1]**2 - q[2]**2 - q[3]**2, 2 * (q[1]*q[2]-q[0]*q[3]), 2*(q[0]*q[2] + q[1]*q[3])],
-                  [2*(q[1]*q[2] + q[0]*q[3]), q[0]**2 - q[1]**2 +
-                      q[2]**2 - q[3]**2, 2*(q[2]*q[3] - q[0]*q[1])],
-                  [2*(q[1]*q[3] - q[0]*q[2]), 2*(q[2]*q[3] + q[0]*q[1]), q[0]**2 - q[1]**2 - q[2]**2 + q[3]**2]])
+    q0, q1, q2, q3 = q.T
+    rotation = np.stack([np.stack([q0**2 + q1**2 - q2**2 - q3**2, 2*(q1*q2 - q0*q3), 2*(q0*q2 + q1*q3)], axis=-1),
+                         np.stack([2*(q1*q2 + q0*q3), q0**2 - q1**2 + q2**2 - q3**2, 2*(q2*q3 - q0*q1)], axis=-1),
+                         np.stack([2*(q1*q3 - q0*q2), 2*(q2*q3 + q0*q1), q0**2 - q1**2 - q2**2 + q3**2], axis=-1)],
+                        axis=1)
     # take into account, that XPlane uses south, not north in the first coordinate
-    A = A * np.array([-1, 1, 1])[:, np.newaxis]
+    rotation[:, 0, :] *= -1
 
-    vBody = np.array([nextFwdSpeed, 0, nextSinkSpeed])
+    vBody = np.stack([fwdSpeed, np.zeros(n), sinkSpeed], axis=-1)
     # see Allerton eq. 3.45
-    vWorld = A.dot(vBody)
+    vWorld = np.einsum('nij,nj->ni', rotation, vBody)
+    return {'aoa': aoa, 'vpath': vpath, 'theta': theta, 'psi': psi, 'phi': phi, 'fwdSpeed': fwdSpeed,
+            'altitude': altitude, 'q': q, 'rotation': rotation, 'vWorld': vWorld}
 
-    # print(true_phi, true_psi, true_theta)
-    print(f'next Roll: {nextPhi}, next Heading: {nextPsi}, next Pitch: {nextTheta}')
-    # print("vWorld : ", vWorld)
-    # print(json.dumps(localVelocity, indent=4, sort_keys=True))
-    # print(json.dumps(vWorld.tolist(), indent=4, sort_keys=True))
-    # print(q)
-    # print(quaternion)
 
-    # prepare the dataref dictionary
+def eulerAnglesFromQuaternion(q):
+    """
+    The heading psi, pitch theta and roll phi [deg] of the quaternions q (the last axis holding q[0]...q[3]),
+    inverting the formulae of prepareInitialPlaneState(). The heading is given in [0, 360).
+    """
+    q0, q1, q2, q3 = np.moveaxis(np.asarray(q, dtype=np.float64), -1, 0)
+    psi = np.degrees(np.arctan2(2*(q0*q3 + q1*q2), 1 - 2*(q2**2 + q3**2))) % 360
+    theta = np.degrees(np.arcsin(np.clip(2*(q0*q2 - q1*q3), -1.0, 1.0)))
+    phi = np.degrees(np.arctan2(2*(q0*q1 + q2*q3), 1 - 2*(q1**2 + q2**2)))
+    return psi, theta, phi
+
+
+def planeStateDataRefs(states, idx=None):
+    """
+    The dataRefs of the SET_PLANE_STATE message for the states of drawInitialPlaneStates(): floats of the state idx,
+    or arrays of all states if idx is None.
+    """
+    if idx is not None:
+        q, vWorld, altitude = states['q'][idx].tolist(), states['vWorld'][idx].tolist(), float(states['altitude'][idx])
+    else:
+        q, vWorld, altitude = states['q'].T, states['vWorld'].T, states['altitude']
     dataRefs = {}
     dataRefs['sim/flightmodel/position/local_vx'] = vWorld[1]
     dataRefs['sim/flightmodel/position/local_vy'] = vWorld[2]
@@ -151,16 +168,11 @@ def prepareInitialPlaneState():
     dataRefs['sim/flightmodel/position/q[1]'] = q[1]
     dataRefs['sim/flightmodel/position/q[2]'] = q[2]
     dataRefs['sim/flightmodel/position/q[3]'] = q[3]
-    dataRefs['sim/flightmodel/position/local_y'] = nextAltitude
+    dataRefs['sim/flightmodel/position/local_y'] = altitude
     # dataRefs['sim/flightmodel/position/P'] = 0  #set the rotation rates to 0
     # dataRefs['sim/flightmodel/position/Q'] = 0
     # dataRefs['sim/flightmodel/position/R'] = 0
-
-    # prepare the entire message to be sent out to the DubinsPilot socket
-    message = {}
-    message['type'] = 'SET_PLANE_STATE'
-    message['data'] = dataRefs
-    return message
+    return dataRefs
 
 
 if __name__ == "__main__":
@@ -2,6 +2,9 @@ import gym_XPlaneEEE.wrappers.wrappers
 
 BufferWrapper = wrappers.BufferWrapper
 ObservationScaler = wrappers.ObservationScaler
+RunningStatistics = wrappers.RunningStatistics
+ObservationNormalizer = wrappers.ObservationNormalizer
+VectorObservationNormalizer = wrappers.VectorObservationNormalizer
 TimeLimit = wrappers.TimeLimit
 EndOfBadEpisodes = wrappers.EndOfBadEpisodes
 TimedActions = wrappers.TimedActions
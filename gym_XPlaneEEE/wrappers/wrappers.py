@@ -4,7 +4,8 @@ import gym
 import gym.spaces
 import numpy as np
 import collections
-import numpy as np
+import time
+from gym_XPlaneEEE.utils.latencyStats import WRAPPER_PREFIX, SCHEDULE
 
 
 class _MeanBuffer:   #bluntly stolen from Lapan p. 260
@@ -28,33 +29,126 @@ class _MeanBuffer:   #bluntly stolen from Lapan p. 260
             return 0.0
         return self.sum / len(self.deque)
 
-class BufferWrapper(gym.ObservationWrapper):
+class AsyncSteps:
+    """
+    Mixin giving a wrapper the step_async(action) / step_wait() interface of the XPlane envs.
+
+    The wrapper's processing is split into _before_step(action), returning the action to pass on, and
+    _after_step(observation, reward, done, info), returning the processed step result. step() runs both around
+    the step of the wrapped env, step_async() and step_wait() around its step_async() and step_wait().
+    If the wrapped env doesn't provide step_async() (e. g. the gym TimeLimit added by gym.make()), step_async()
+    steps it synchronously, so the action still goes out right away, and step_wait() hands out the kept result.
+
+    If the unwrapped env has latencyStats, the time spent in _before_step() and _after_step() is recorded as stage
+    'wrapper.<class name>'. A wrapper that deliberately waits in _before_step() (see TimedActions) sets
+    _scheduled_seconds to the time waited; that is recorded as stage 'schedule' instead.
+    """
+    _pending_result = None
+    _own_seconds = 0.0
+    _scheduled_seconds = None   #None: the wrapper doesn't schedule its steps
+
+    def _before_step(self, action):
+        return action
+
+    def _after_step(self, observation, reward, done, info):
+        return observation, reward, done, info
+
+    def _latency_stats(self):
+        return getattr(self.unwrapped, 'latencyStats', None)
+
+    def _record_latency(self, latency_stats, seconds):
+        if self._scheduled_seconds is None:
+            latency_stats.record(WRAPPER_PREFIX + type(self).__name__, seconds)
+        else:
+            latency_stats.record(WRAPPER_PREFIX + type(self).__name__, seconds - self._scheduled_seconds)
+            latency_stats.record(SCHEDULE, self._scheduled_seconds)
+
+    def step(self, action):
+        latency_stats = self._latency_stats()
+        if latency_stats is None:
+            return self._after_step(*self.env.step(self._before_step(action)))
+        start = time.perf_counter()
+        action = self._before_step(action)
+        own_seconds = time.perf_counter() - start
+        result = self.env.step(action)
+        start = time.perf_counter()
+        result = self._after_step(*result)
+        self._record_latency(latency_stats, own_seconds + time.perf_counter() - start)
+        return result
+
+    def step_async(self, action):
+        start = time.perf_counter()
+        action = self._before_step(action)
+        self._own_seconds = time.perf_counter() - start
+        if hasattr(type(self.env), 'step_async'):   #not just forwarded by gym.Wrapper.__getattr__
+            self._pending_result = None
+            self.env.step_async(action)
+        else:
+            self._pending_result = self.env.step(action)
+
+    def step_wait(self):
+        if self._pending_result is None:
+            result = self.env.step_wait()
+        else:
+            result, self._pending_result = self._pending_result, None
+        start = time.perf_counter()
+        result = self._after_step(*result)
+        latency_stats = self._latency_stats()
+        if latency_stats is not None:
+            self._record_latency(latency_stats, self._own_seconds + time.perf_counter() - start)
+        return result
+
+class _AsyncObservationSteps(AsyncSteps):
+    def _after_step(self, observation, reward, done, info):
+        return self.observation(observation), reward, done, info
+
+class BufferWrapper(_AsyncObservationSteps, gym.ObservationWrapper):
     """
     Replaces the single observation coming directly from the environment by a stack of
-    the last n_steps observations.
+    the last n_steps observations (oldest first, flattened to match the observation_space).
 
     This wrapper can be used to present some dynamics over the last steps to the agent.
 
-    TODO: Check the datatypes. I'm not quite sure whether all the matix and tensor shapes are really correct.
+    The observations are kept in a preallocated ring buffer holding every observation twice, so the stack is
+    always a contiguous block of it and the cost of a step doesn't depend on n_steps (apart from copying the stack).
+    After a reset, the stack is padded with zeros.
+
+    Args
+    ----
+    :param n_steps: the number of observations to stack
+
+    :param dtype = np.float32: the dtype of the stacked observations
+
+    :param copy = True: return a new array every step. If False, a read only view of the ring buffer is returned,
+    which is only valid until the next step.
     """
-    def __init__(self, env, n_steps, dtype=np.float32):
+    def __init__(self, env, n_steps, dtype=np.float32, copy=True):
         super(BufferWrapper, self).__init__(env)
         self.dtype = dtype
+        self.n_steps = n_steps
+        self.copy = copy
         old_space = env.observation_space
         self.observation_space = gym.spaces.Box(np.tile(old_space.low, n_steps),
                                                 np.tile(old_space.high, n_steps), dtype=dtype)
-        self.buffer = collections.deque(maxlen = len(self.observation_space.low))
+        self.buffer = np.zeros((2 * n_steps,) + old_space.shape, dtype=dtype)
+        self.pos = 0    #the row of the latest observation in the first half
 
     def reset(self):
-        self.buffer.extend(np.zeros_like(self.observation_space.low, dtype=self.dtype))
-        self.buffer.extend(self.observation(self.env.reset()))
-        return list(self.buffer)
+        self.buffer[:] = 0
+        self.pos = self.n_steps - 1
+        return self.observation(self.env.reset())
 
     def observation(self, observation):
-        self.buffer.extend(observation)
-        return list(self.buffer)
-
-class ObservationScaler(gym.ObservationWrapper):
+        self.pos = (self.pos + 1) % self.n_steps
+        self.buffer[self.pos] = observation
+        self.buffer[self.pos + self.n_steps] = observation
+        stack = self.buffer[self.pos + 1:self.pos + 1 + self.n_steps].reshape(-1)
+        if self.copy:
+            return stack.copy()
+        stack.flags.writeable = False
+        return stack
+
+class ObservationScaler(_AsyncObservationSteps, gym.ObservationWrapper):
     """
     Scales the observation values from their full ranges to the interval [-1, 1]
 
@@ -73,8 +167,167 @@ class ObservationScaler(gym.ObservationWrapper):
     def observation(self, observation):
         return (observation - self.rangeMean)*self.scaleFactor
 
-import time
-class TimeLimit(gym.Wrapper):
+import threading
+class RunningStatistics:
+    """
+    Running mean and variance of batches of observations.
+
+    Batches are merged with the parallel algorithm of Chan et al., which stays numerically stable over millions
+    of samples. mean and var are float32 arrays updated in place, so every ObservationNormalizer sharing a
+    RunningStatistics instance sees the updates at once. Updates are serialized by a lock, as the sub-envs of
+    a XplaneEEEVectorEnv step in parallel threads.
+
+    Arguments
+    ---------
+    :param shape: the shape of a single observation
+
+    :param epsilon = 1e-4: the initial count, keeping the first normalizations finite
+    """
+    def __init__(self, shape, epsilon=1e-4):
+        self.mean = np.zeros(shape, dtype=np.float32)
+        self.var = np.ones(shape, dtype=np.float32)
+        self.count = epsilon
+        self._lock = threading.Lock()
+
+    def update(self, batch):
+        """Merges a batch of shape (n,) + shape into the statistics."""
+        batch = np.asarray(batch, dtype=np.float32)
+        batch_count = batch.shape[0]
+        if not batch_count:
+            return
+        batch_mean = batch.mean(axis=0)
+        batch_var = batch.var(axis=0)
+        with self._lock:
+            total = self.count + batch_count
+            delta = batch_mean - self.mean
+            #M2 of the merged batches divided by the total count
+            self.var *= self.count / total
+            self.var += batch_var * (batch_count / total) + delta**2 * (self.count * batch_count / total**2)
+            self.mean += delta * (batch_count / total)
+            self.count = total
+
+    def normalize(self, observation, clip=10.0, epsilon=1e-8):
+        """Returns the float32 observation (or batch of observations) scaled to zero mean and unit variance."""
+        normalized = (np.asarray(observation, dtype=np.float32) - self.mean) / np.sqrt(self.var + epsilon)
+        return np.clip(normalized, -clip, clip, out=normalized)
+
+    def save(self, path):
+        """Saves the statistics in the .npz format to exactly the file path, so load(path) finds them."""
+        with open(path, 'wb') as npzFile:   #np.savez() would append .npz to a path without it
+            np.savez(npzFile, mean=self.mean, var=self.var, count=self.count)
+
+    def load(self, path):
+        """Loads the statistics saved by save() in place."""
+        with np.load(path) as data:
+            with self._lock:
+                self.mean[...] = data['mean']
+                self.var[...] = data['var']
+                self.count = float(data['count'])
+
+class ObservationNormalizer(_AsyncObservationSteps, gym.ObservationWrapper):
+    """
+    Normalizes the observations to zero mean and unit variance with running statistics of all observations seen.
+
+    Unlike the ObservationScaler this adapts to the actual distribution of the values, which helps with badly
+    conditioned features like Qrad that use only a tiny part of their Box. Freeze the statistics for evaluation
+    and save them together with the agent to reproduce its inputs.
+
+    Arguments
+    ---------
+    :param statistics = None: the RunningStatistics to use. Pass the same instance to the wrappers of all
+    sub-envs of a vector env to share them. New statistics if None is given.
+
+    :param clip = 10.0: the normalized values are clipped to [-clip, clip]
+
+    :param frozen = False: whether to keep the statistics fixed (e. g. for evaluation)
+    """
+    def __init__(self, env, statistics=None, clip=10.0, frozen=False):
+        super(ObservationNormalizer, self).__init__(env)
+        old_space = env.observation_space
+        self.statistics = statistics if statistics is not None else RunningStatistics(old_space.shape)
+        self.clip = clip
+        self.frozen = frozen
+        self.observation_space = gym.spaces.Box(-clip, clip, shape=old_space.shape, dtype=np.float32)
+
+    def observation(self, observation):
+        if not self.frozen:
+            self.statistics.update(np.asarray(observation)[np.newaxis])
+        return self.statistics.normalize(observation, self.clip)
+
+    def freeze(self):
+        self.frozen = True
+
+    def unfreeze(self):
+        self.frozen = False
+
+    def save(self, path):
+        self.statistics.save(path)
+
+    def load(self, path):
+        self.statistics.load(path)
+
+class VectorObservationNormalizer:
+    """
+    The ObservationNormalizer for vector envs (XplaneEEEVectorEnv, XplaneEEESimVectorEnv).
+    The statistics are updated once per step with the whole batch of observations. The terminal observations
+    in the infos are normalized as well.
+
+    Arguments
+    ---------
+    see ObservationNormalizer
+    """
+    def __init__(self, venv, statistics=None, clip=10.0, frozen=False):
+        self.venv = venv
+        old_space = venv.observation_space
+        self.statistics = statistics if statistics is not None else RunningStatistics(old_space.shape)
+        self.clip = clip
+        self.frozen = frozen
+        self.num_envs = venv.num_envs
+        self.action_space = venv.action_space
+        self.observation_space = gym.spaces.Box(-clip, clip, shape=old_space.shape, dtype=np.float32)
+
+    def _normalize(self, obs):
+        if not self.frozen:
+            self.statistics.update(obs)
+        return self.statistics.normalize(obs, self.clip)
+
+    def reset(self):
+        return self._normalize(self.venv.reset())
+
+    def step(self, actions):
+        return self._after_step(*self.venv.step(actions))
+
+    def step_async(self, actions):
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        return self._after_step(*self.venv.step_wait())
+
+    def _after_step(self, obs, rewards, dones, infos):
+        for info in infos:
+            if 'terminal_observation' in info:
+                info['terminal_observation'] = self.statistics.normalize(info['terminal_observation'], self.clip)
+        return self._normalize(obs), rewards, dones, infos
+
+    def render(self, mode='human'):
+        return self.venv.render(mode)
+
+    def close(self):
+        self.venv.close()
+
+    def freeze(self):
+        self.frozen = True
+
+    def unfreeze(self):
+        self.frozen = False
+
+    def save(self, path):
+        self.statistics.save(path)
+
+    def load(self, path):
+        self.statistics.load(path)
+
+class TimeLimit(AsyncSteps, gym.Wrapper):
     """
     Applies a time limit or a maximum number of steps to the episodes of an environment.
     This enables the splitting of "endless" environments into smaller episodes for training.
@@ -84,13 +337,19 @@ class TimeLimit(gym.Wrapper):
     :param max_episode_seconds = None: give maximum length in seconds
 
     :param max_episode_steps = None: give maximum length in steps
+
+    :param max_episode_sim_seconds = None: give maximum length in seconds of simulated flight. This needs an env
+    in lockstep mode, reporting the simulation time as info['simTime'].
     """
-    def __init__(self, env, max_episode_seconds=None, max_episode_steps=None):
+    def __init__(self, env, max_episode_seconds=None, max_episode_steps=None, max_episode_sim_seconds=None):
         super(TimeLimit, self).__init__(env)
         self._max_episode_seconds = max_episode_seconds
         self._max_episode_steps = max_episode_steps
+        self._max_episode_sim_seconds = max_episode_sim_seconds
         self._elapsed_steps = 0
         self._episode_started_at = None
+        self._episode_started_at_sim_time = None
+        self._elapsed_sim_seconds = 0.0
 
     @property
     def _elapsed_seconds(self):
@@ -106,12 +365,22 @@ class TimeLimit(gym.Wrapper):
             gym.logger.debug("Env has passed the seconds limit defined by TimeLimit.")
             return True
 
+        if self._max_episode_sim_seconds is not None and self._max_episode_sim_seconds <= self._elapsed_sim_seconds:
+            gym.logger.debug("Env has passed the simulation time limit defined by TimeLimit.")
+            return True
+
         return False
 
-    def step(self, action):
+    def _before_step(self, action):
         assert self._episode_started_at is not None, "Cannot call env.step() before calling reset()"
-        observation, reward, done, info = self.env.step(action)
+        return action
+
+    def _after_step(self, observation, reward, done, info):
         self._elapsed_steps += 1
+        if 'simTime' in info:
+            if self._episode_started_at_sim_time is None:
+                self._episode_started_at_sim_time = info['simTime']
+            self._elapsed_sim_seconds = info['simTime'] - self._episode_started_at_sim_time
 
         if self._past_limit():
             if self.metadata.get('semantics.autoreset'):
@@ -123,9 +392,13 @@ class TimeLimit(gym.Wrapper):
     def reset(self, **kwargs):
         self._episode_started_at = time.time()
         self._elapsed_steps = 0
-        return self.env.reset(**kwargs)
+        self._elapsed_sim_seconds = 0.0
+        observation = self.env.reset(**kwargs)
+        #the simulation time at the start of the episode, if the env tells it
+        self._episode_started_at_sim_time = getattr(self.unwrapped, 'simTime', None)
+        return observation
 
-class EndOfBadEpisodes(gym.Wrapper):
+class EndOfBadEpisodes(AsyncSteps, gym.Wrapper):
     """
     Prematurely ends an episode if the mean reward gained over the last n_steps steps
     is worse than the limit given in worst_reward_limit.
@@ -146,8 +419,7 @@ class EndOfBadEpisodes(gym.Wrapper):
         self._past_reward_buffer = _MeanBuffer(n_steps)
         self._suicide_penalty = suicide_penalty
 
-    def step(self, action):
-        observation, reward, done, info = self.env.step(action)
+    def _after_step(self, observation, reward, done, info):
         self._past_reward_buffer.add(reward)
         mean = self._past_reward_buffer.mean()
         if  mean < self._worst_reward_limit:
@@ -163,35 +435,115 @@ class EndOfBadEpisodes(gym.Wrapper):
         return self.env.reset(**kwargs)
 
 
-class TimedActions(gym.ActionWrapper):
+SPIN_SECONDS = 0.002    #the last part of a wait is spent spinning, as sleep() may overshoot by about that much
+
+class TimedActions(AsyncSteps, gym.ActionWrapper):
     """
     An ActionWrapper for gym environments that issues only a given (maximum) amount of actions per second to
     the environment. This is useful for interacting with real-time physical systems that need some time to settle
     after an action was issued. (e. g. interaction with XPlane where it deosn't make any sense to issue more than
     half a handful of commands per second.)
 
+    The actions are scheduled on a fixed grid of the monotonic clock, so small delays don't accumulate. Waiting
+    sleeps until shortly before the deadline and spins for the rest, which keeps the jitter well below the
+    granularity of the OS sleep. When a step took longer than the period, catch_up decides what happens:
+      - 'reanchor': issue the action immediately and restart the grid from now
+      - 'drop': skip the missed slots and wait for the next slot of the grid
+      - 'burst': issue the missed actions immediately one after another until the grid is caught up
+
     After a env.reset() the next action may be issued immediately.
         Arguments
     ---------
     :param actions_per_second = 10: the number of steps per second that are maximally issued to the environment
 
+    :param catch_up = 'reanchor': 'reanchor', 'drop' or 'burst'
+
+    :param align_to_frames = False: after the deadline, additionally wait for the next PLANE_STATE received
+    (at most one period), so every action is based on a fresh frame. Needs an env with a DataCenter.
+
+    :param spin_seconds = SPIN_SECONDS: how long before the deadline to stop sleeping and start spinning
     """
-    def __init__(self, env, actions_per_second = 10):
+    def __init__(self, env, actions_per_second = 10, catch_up = 'reanchor', align_to_frames = False,
+                 spin_seconds = SPIN_SECONDS):
         super(TimedActions, self).__init__(env)
+        if catch_up not in ('reanchor', 'drop', 'burst'):
+            raise ValueError("Unknown catch_up policy {}. Use 'reanchor', 'drop' or 'burst'.".format(catch_up))
         self.time_delay_between_actions = 1/actions_per_second
-        #initialize next action time so that the first action will be issued immeadiately
-        self.next_action_time = time.time()
-
-    def step(self, action):
-        wait_time = self.next_action_time - time.time() #determine the waiting time from now on
-        self.next_action_time += self.time_delay_between_actions #reschedule the event
-        if wait_time > 0:
-            time.sleep(wait_time)
-        return self.env.step(action)    #finally issue the action and return
+        self.catch_up = catch_up
+        self.align_to_frames = align_to_frames
+        self.spin_seconds = spin_seconds
+        self.dc = env.unwrapped.dc if align_to_frames else None
+        self.reset_statistics()
+        #the first action will be issued immeadiately
+        self.next_action_time = None
+
+    def reset_statistics(self):
+        self.scheduled_steps = 0
+        self.overruns = 0       #steps that arrived after their deadline
+        self.dropped_slots = 0  #slots skipped by the 'drop' policy
+        self._jitter_sum = 0.0
+        self._jitter_square_sum = 0.0
+        self.max_jitter = 0.0
+
+    def get_statistics(self):
+        """
+        Returns
+        -------
+        A dict with the number of scheduled steps (not counting the first step after a reset), overruns and dropped slots and the mean, standard deviation and maximum of
+        the jitter (the seconds between the deadline and the actual issue of an action in time) so far.
+        """
+        on_time = self.scheduled_steps - self.overruns
+        mean = self._jitter_sum / on_time if on_time else 0.0
+        variance = self._jitter_square_sum / on_time - mean**2 if on_time else 0.0
+        return {'steps': self.scheduled_steps, 'overruns': self.overruns, 'dropped_slots': self.dropped_slots,
+                'mean_jitter': mean, 'std_jitter': np.sqrt(max(variance, 0.0)), 'max_jitter': self.max_jitter}
+
+    def _wait_until(self, deadline):
+        start = time.perf_counter()
+        remaining = deadline - start
+        if remaining > self.spin_seconds:
+            time.sleep(remaining - self.spin_seconds)
+        while time.perf_counter() < deadline:
+            pass
+        self._scheduled_seconds += time.perf_counter() - start
+
+    def _before_step(self, action):
+        period = self.time_delay_between_actions
+        self._scheduled_seconds = 0.0
+        now = time.perf_counter()
+        if self.next_action_time is None:
+            #the first action after a reset starts the grid
+            self.next_action_time = now + period
+        elif now <= self.next_action_time:
+            self.scheduled_steps += 1
+            self._wait_until(self.next_action_time)
+            jitter = time.perf_counter() - self.next_action_time
+            self._jitter_sum += jitter
+            self._jitter_square_sum += jitter**2
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.next_action_time += period #reschedule the event
+        else:
+            self.scheduled_steps += 1
+            self.overruns += 1
+            if self.catch_up == 'reanchor':
+                self.next_action_time = now + period
+            elif self.catch_up == 'drop':
+                missed = int((now - self.next_action_time) // period) + 1
+                self.dropped_slots += missed
+                self.next_action_time += missed * period
+                self._wait_until(self.next_action_time)
+                self.next_action_time += period
+            else:
+                self.next_action_time += period
+        if self.align_to_frames:
+            start = time.perf_counter()
+            self.dc.waitForNFrames(1, timeout=period)
+            self._scheduled_seconds += time.perf_counter() - start
+        return action   #finally issue the action
     
     def reset(self, **kwargs):
-        #re-initialize next action time so that the first action will be issued immeadiately
-        self.next_action_time = time.time()
+        #the next action will be issued immeadiately
+        self.next_action_time = None
         return self.env.reset(**kwargs)
 
 class FakeActions(gym.ActionWrapper):
@@ -200,9 +552,13 @@ class FakeActions(gym.ActionWrapper):
     """
     def __init__(self, env, actions_per_second = 10):
         super(FakeActions, self).__init__(env)
+        self._pending_action = 0.0
 
     def step(self, action):
         return self.env.fakeStep(action)    #finally issue the fakeAction action and return
-    
 
+    def step_async(self, action):
+        self._pending_action = action   #there is no response to wait for
 
+    def step_wait(self):
+        return self.env.fakeStep(self._pending_action)
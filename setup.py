@@ -2,5 +2,5 @@ from setuptools import setup
 
 setup(name='gym_XPlaneEEE',
       version='0.0.1',
-      install_requires=['gym>=0.12.1']
+      install_requires=['gym>=0.12.1', 'scipy']
 )